@@ -1,32 +1,111 @@
 """
 Enhanced BLE DMM -> Web Dashboard with Modern UI
 
-- Connects to your Bluetooth DMM (bleak)
+- Connects to your Bluetooth DMM (bleak), found by address or by name
+  (cached discovery, see discovery.py)
 - Decodes readings (your original logic kept)
 - Serves a beautiful modern web UI with live updating via SSE
   * /            -> Enhanced HTML dashboard with widgets & graphs
-  * /api/latest  -> latest reading as JSON
-  * /stream      -> live Server-Sent Events
+  * /api/latest  -> latest reading as JSON (ETag / If-None-Match, ?wait= long-poll)
+  * /api/devices -> latest reading of every meter
+  * /api/sinks   -> connection state, queued/sent/dropped samples per sink
+  * /api/history -> samples incl. derived channels (?device=&since=&until=&limit=)
+  * /api/export  -> the same samples as CSV
+  * /api/distribution -> quantiles + histogram per quantity (?device=&unit=&session=
+                     &since=&until=&q=&bins=&every=), merged across meters/sessions
+  * /stream      -> live Server-Sent Events (?device= to follow one meter)
+  * /api/debug   -> prepared frame bits, per-bit toggle counts and labels (?device=)
+  * /api/debug/stream -> SSE of the bits that changed, frame by frame (?device=)
+  * /admin/...   -> profiler, memory snapshots, task dump (only with ADMIN_TOKEN)
+- Derived channels (Ah/Wh integration, derivative, filters; see derived.py)
+- Optionally records every sample to JSON-lines segment files, compacted
+  into compressed archives once closed (see archive.py)
+- Optionally aggregates ESP32 firmware bridges (see esp32_pool.py), feeding
+  their readings through the same history, derived channels and SSE fan-out
+- Optionally publishes every sample to MQTT / TCP sinks (see sinks.py)
+- Optionally runs the meter readers in supervised worker processes that
+  hand samples over through shared-memory rings (SHARDS, see shards.py)
 
 Requires: bleak, aiohttp
 pip install bleak aiohttp
 """
 import asyncio
+import csv
+import functools
+import hmac
+import io
 import json
 import logging
+import math
+import os
 import signal
-from datetime import datetime
 
 from bleak import BleakClient
 from aiohttp import web
 
+import archive
+from bitdiff import BitTracker
+from clock import CaptureClock, format_wall
+from derived import DerivedPipeline
+from discovery import DeviceCache, Discovery, is_placeholder
+from distribution import DistributionStore, quantity
+from esp32_pool import Esp32Poller
+from history import History, Recorder, sample_record
+from profiling import MemoryTracer, SamplingProfiler, TaskWatch
+from shards import ADDRESS_BYTES, FRAME, SAMPLE, SampleRing, Supervisor
+from simulator import SimulatedClient, sim_address
+from sinks import make_sink
+
 # ----------------- Configuration -----------------
 TARGET_NAME = "Bluetooth DMM"
-TARGET_ADDR_STR = "XX:XX:XX:XX:XX:XX"  # your device's MAC address
+TARGET_ADDR_STR = "XX:XX:XX:XX:XX:XX"  # your device's MAC address, or leave as is to find it by TARGET_NAME
 HTTP_HOST = "0.0.0.0"
 HTTP_PORT = 8000
 POLL_HZ = 3.0  # reads per second
 READ_CHAR_HANDLE = 8  # your device's handle as in original script
+FRAME_DEBUG = False  # track bit changes of every frame for /api/debug
+DISCOVERY_CACHE_TTL_S = 7 * 24 * 3600  # how long resolved addresses/types are trusted
+DISCOVERY_WATCH = False  # keep scanning and attach every meter that shows up
+# Output sinks, e.g. "mqtt://broker.local/plant/dmm" or "tcp://127.0.0.1:9000"
+SINK_URLS = []
+SINK_BATCH_SIZE = 64     # max samples per write
+SINK_LINGER_S = 0.05     # max wait for a batch to fill
+SINK_QUEUE_SIZE = 1024   # bounded outbound queue per sink
+SINK_DROP = "oldest"     # "oldest" or "newest" when the queue is full
+LONGPOLL_MAX_S = 30.0    # upper bound for /api/latest?wait=
+# Enables the /admin/* diagnostics, sent as "Authorization: Bearer <token>"
+ADMIN_TOKEN = None
+PROFILE_MAX_S = 300.0    # longest /admin/profile run
+PROFILE_MAX_HZ = 1000.0  # highest /admin/profile sampling rate
+# Extra series computed from every sample, see derived.py for the options
+DERIVED_CHANNELS = [
+    # {"name": "charge_Ah", "kind": "integrate", "unit": "A", "scale": 1/3600},
+    # {"name": "smooth", "kind": "ema", "tau_s": 2.0},
+]
+HISTORY_SAMPLES = 20000  # in-memory samples per meter for /api/history
+RECORD_DIR = None        # e.g. "recordings" to persist all samples
+RECORD_SEGMENT_S = 3600  # one recording file per hour
+ARCHIVE_SEGMENTS = True  # compress closed recording files (archive.py)
+ARCHIVE_KEEP_JSONL = False  # keep the uncompressed file next to the archive
+DISTRIBUTION_BUCKET_S = 300     # time resolution of /api/distribution rollups
+DISTRIBUTION_MAX_BUCKETS = 2000  # bucket summaries kept; session totals are always kept
+DISTRIBUTION_PATH = None        # e.g. "distributions.json" to keep sessions across restarts
+BLE_ENABLED = True        # False for an ESP32-only aggregator
+# ESP32 bridges running wifi_multimeter.ino, e.g. ["192.168.1.50", "http://dmm-2.local"]
+ESP32_ENDPOINTS = []
+ESP32_MIN_INTERVAL_S = 0.333  # poll interval while the reading changes
+ESP32_MAX_INTERVAL_S = 5.0    # poll interval once the reading is steady
+ESP32_TIMEOUT_S = 2.0
+# Run N virtual meters (simulator.py) instead of the BLE device, e.g. for load tests
+SIMULATED_DEVICES = 0
+SIMULATED_POLL_HZ = POLL_HZ
+# Sharded mode: one reader process per entry, e.g.
+#   [{"adapter": "hci0", "devices": ["AA:BB:..", "CC:DD:.."]}, {"adapter": "hci1", "devices": [...]}]
+# {"simulated": N} adds N virtual meters to a shard. Empty = everything in one process
+SHARDS = []
+SHARD_RING_SLOTS = 4096   # samples buffered per shard between worker and web process
+                          # (FRAME_DEBUG adds a record per sample, halving that)
+SHARD_POLL_S = 0.005      # how often the web process checks the rings when idle
 # -------------------------------------------------
 
 LOG = logging.getLogger("ble_dmm_web")
@@ -170,116 +249,389 @@ class decoder_3(decoder_1):
 class decoder_4(decoder_1):
     pass
 
+DECODERS = {'1': decoder_1, '2': decoder_2, '3': decoder_3, '4': decoder_4}
+
 # ======= Shared state for web/UI =======
 
-latest = {
-    "timestamp": None,
-    "value": None,
-    "unit": "",
-    "functions": "",
-    "device_type": None,
-    "connected": False,
-    "target_name": TARGET_NAME,
-    "target_addr": TARGET_ADDR_STR,
-}
-sse_clients = set()
-
-def make_payload():
+CLOCK = CaptureClock()
+discovery = Discovery(names=(TARGET_NAME,), cache=DeviceCache(ttl_s=DISCOVERY_CACHE_TTL_S))
+
+def new_device_state(address):
     return {
-        **latest,
-        "timestamp": latest["timestamp"],
-        "value": latest["value"],
-        "unit": latest["unit"],
-        "functions": latest["functions"],
-        "connected": latest["connected"],
+        "t_mono_ns": None,  # monotonic capture time, exact inter-sample deltas
+        "t_wall_ns": None,  # capture time on the wall clock (epoch ns)
+        "value": None,
+        "unit": "",
+        "functions": "",
+        "device_type": None,
+        "connected": False,
+        "target_name": TARGET_NAME,
+        "target_addr": address,
+        "derived": {},
+        "seq": 0,
     }
 
+devices = {}     # address -> state of that meter
+latest = new_device_state(TARGET_ADDR_STR)  # most recently updated meter
+seq = 0          # global, monotonically increasing across all meters
+BOOT = os.urandom(4).hex()  # tags ETags so that a restart invalidates them
+sse_clients = {}  # queue -> device address filter (None = all meters)
+sinks = []
+pipelines = {}   # address -> DerivedPipeline
+history = History(HISTORY_SAMPLES)
+distributions = DistributionStore(DISTRIBUTION_BUCKET_S, DISTRIBUTION_MAX_BUCKETS, path=DISTRIBUTION_PATH)
+recorder = None  # Recorder when RECORD_DIR is set
+new_sample = asyncio.Event()  # replaced on every update, see set_latest()
+_json_cache = {}  # address -> {"seq", "payload", "body"}
+frame_trackers = {}  # address -> BitTracker (FRAME_DEBUG)
+debug_clients = {}   # queue -> device address filter, /api/debug/stream
+_frame_labels = {}   # (decoder, nbits) -> {bit index: label}
+
+def set_latest(address=TARGET_ADDR_STR, **fields):
+    """Update a meter's state, bump the sequence number and wake long-pollers."""
+    global latest, seq, new_sample
+    state = devices.get(address)
+    if state is None:
+        state = devices[address] = new_device_state(address)
+    state.update(fields)
+    seq += 1
+    state["seq"] = seq
+    latest = state
+    ev, new_sample = new_sample, asyncio.Event()
+    ev.set()
+    return state
+
+def get_state(address=None):
+    if address is None:
+        return latest
+    return devices.get(address)
+
+def make_payload(state=None):
+    state = latest if state is None else state
+    return {
+        **state,
+        "timestamp": format_wall(state["t_wall_ns"]),
+        "value": state["value"],
+        "unit": state["unit"],
+        "functions": state["functions"],
+        "connected": state["connected"],
+    }
+
+def state_etag(state):
+    return f'"{BOOT}-{state["seq"]}"'
+
+def _cached(state):
+    # Build and serialize at most once per sequence number, however many
+    # clients poll or subscribe
+    c = _json_cache.get(state["target_addr"])
+    if c is None or c["seq"] != state["seq"]:
+        payload = make_payload(state)
+        c = _json_cache[state["target_addr"]] = {
+            "seq": state["seq"],
+            "payload": payload,
+            "body": json.dumps(payload).encode("utf-8"),
+        }
+    return c
+
+def latest_payload(state=None) -> dict:
+    return _cached(latest if state is None else state)["payload"]
+
+def latest_json(state=None) -> bytes:
+    return _cached(latest if state is None else state)["body"]
+
 async def broadcast(payload: dict):
     if not sse_clients:
         return
-    data = f"data: {json.dumps(payload)}\n\n"
+    c = _json_cache.get(payload.get("target_addr"))
+    if c is not None and payload is c["payload"]:
+        data = f"data: {c['body'].decode('utf-8')}\n\n"
+    else:
+        data = f"data: {json.dumps(payload)}\n\n"
+    address = payload.get("target_addr")
     dead = []
-    for q in sse_clients:
+    for q, only in sse_clients.items():
+        if only is not None and only != address:
+            continue
         try:
             await q.put(data)
         except Exception:
             dead.append(q)
     for q in dead:
-        sse_clients.discard(q)
+        sse_clients.pop(q, None)
+
+async def publish_sample(address, **fields):
+    """Single entry point for a decoded sample from any acquisition source."""
+    if DERIVED_CHANNELS:
+        pipe = pipelines.get(address)
+        if pipe is None:
+            pipe = pipelines[address] = DerivedPipeline(DERIVED_CHANNELS)
+        fields["derived"] = pipe.update(fields["t_mono_ns"], fields["value"], fields["unit"])
+    state = set_latest(address, **fields)
+    payload = latest_payload(state)
+    record = sample_record(payload)
+    history.append(record)
+    distributions.add(address, state["t_wall_ns"], state["value"], state["unit"])
+    if recorder is not None:
+        recorder.write(record)
+    await broadcast(payload)
+    for sink in sinks:
+        sink.offer(payload)
+
+def frame_labels(dec, nbits):
+    """Names the decoder gives each bit, found by decoding one-hot frames."""
+    labels = _frame_labels.get((dec, nbits))
+    if labels is None:
+        labels = _frame_labels[(dec, nbits)] = {}
+        for i in range(nbits):
+            try:
+                functions, units = dec.printchar("0" * i + "1" + "0" * (nbits - i - 1))
+            except IndexError:
+                continue
+            names = [n for n in functions + units if n]
+            if names:
+                labels[i] = "/".join(names)
+            elif 28 <= i < 60:
+                labels[i] = f"digit {(i - 28) // 8 + 1} seg {(i - 28) % 8}"
+    return labels
+
+def device_labels(address, nbits):
+    state = devices.get(address)
+    return frame_labels(DECODERS.get(state and state["device_type"], decoder_1), nbits)
+
+def debug_snapshot(address):
+    tr = frame_trackers[address]
+    labels = device_labels(address, tr.nbits)
+    active = tr.active()
+    return {
+        "device": address,
+        "frames": tr.frames,
+        "changed_frames": tr.changed_frames,
+        "bits": tr.bit_string(),
+        "bit_indices": active,
+        "active": {i: labels.get(i, "") for i in active},
+        "toggles": {i: n for i, n in enumerate(tr.toggles) if n},
+        "labels": labels,
+    }
+
+def frame_event(address, t_mono_ns, on, off, first=False) -> str:
+    labels = device_labels(address, frame_trackers[address].nbits)
+    event = {
+        "device": address,
+        "t_mono_ns": t_mono_ns,
+        "timestamp": format_wall(CLOCK.to_wall_ns(t_mono_ns)),
+        "on": on,
+        "off": off,
+        "labels": {i: labels[i] for i in on + off if i in labels},
+    }
+    if first:
+        event["first"] = True  # all bits currently set, not a change
+    return f"data: {json.dumps(event)}\n\n"
+
+def observe_frame(address, t_mono_ns, bits: int, nbits: int):
+    """XOR a prepared frame against the previous one; fan out what changed."""
+    tr = frame_trackers.get(address)
+    if tr is None:
+        tr = frame_trackers[address] = BitTracker()
+    changed = tr.update(bits, nbits, t_mono_ns)
+    if not debug_clients or changed == ([], []):
+        return
+    if changed is None:
+        data = frame_event(address, t_mono_ns, tr.active(), [], first=True)
+    else:
+        data = frame_event(address, t_mono_ns, *changed)
+    for q, only in debug_clients.items():
+        if only is None or only == address:
+            q.put_nowait(data)
 
 # ======= BLE reader task =======
 
-async def ble_reader(stop_event: asyncio.Event):
-    address = TARGET_ADDR_STR
+async def ble_reader(stop_event: asyncio.Event, address=TARGET_ADDR_STR,
+                     client_factory=BleakClient, poll_hz=POLL_HZ, cache=None,
+                     on_sample=None, on_status=None, on_frame=None):
+    # In a shard worker samples, status and frames go to the ring instead
+    publish = on_sample or publish_sample
+    status = on_status or set_latest
+    frame = on_frame or observe_frame
     LOG.info("Target name: %s | Target address: %s", TARGET_NAME, address)
+    by_name = is_placeholder(address)
+    if by_name:
+        address = None
+    failures = 0
 
     while not stop_event.is_set():
         try:
-            async with BleakClient(address) as client:
-                latest["connected"] = bool(client.is_connected)
-                LOG.info("Connected: %s", client.is_connected)
-
-                try:
-                    raw = bytes(await client.read_gatt_char(READ_CHAR_HANDLE, use_cached=1)).hex()
-                except Exception as e:
-                    LOG.warning("Failed to read initial char: %s", e)
-                    latest["connected"] = False
-                    await asyncio.sleep(2.0)
+            if by_name:
+                address = await discovery.resolve(TARGET_NAME)
+                if address is None:
+                    LOG.warning("No meter named %r or with the meter service UUIDs found, "
+                                "still scanning", TARGET_NAME)
                     continue
+            async with client_factory(address) as client:
+                status(address, connected=bool(client.is_connected))
+                LOG.info("Connected: %s", client.is_connected)
+                failures = 0
 
-                dev_type = type_detecter.type(raw)
-                latest["device_type"] = dev_type
+                dev_type = cache.device_type(address) if cache is not None else None
+                if dev_type is None:
+                    try:
+                        raw = bytes(await client.read_gatt_char(READ_CHAR_HANDLE, use_cached=1)).hex()
+                    except Exception as e:
+                        LOG.warning("Failed to read initial char: %s", e)
+                        status(address, connected=False)
+                        await asyncio.sleep(2.0)
+                        continue
+                    dev_type = type_detecter.type(raw)
+                    if cache is not None and dev_type is not None:
+                        cache.remember(address, device_type=dev_type)
+                status(address, device_type=dev_type)
                 LOG.info("Detected type: %s", dev_type)
 
-                if dev_type == '1':
-                    dec = decoder_1
-                elif dev_type == '2':
-                    dec = decoder_2
-                elif dev_type == '3':
-                    dec = decoder_3
-                elif dev_type == '4':
-                    dec = decoder_4
-                else:
+                dec = DECODERS.get(dev_type)
+                if dec is None:
                     LOG.warning("Unknown device type. Using decoder_1 as fallback.")
                     dec = decoder_1
 
-                period = 1.0 / max(POLL_HZ, 0.1)
+                period_ns = int(1e9 / max(poll_hz, 0.1))
+                next_due = CLOCK.capture()
                 while not stop_event.is_set():
                     try:
                         raw = bytes(await client.read_gatt_char(READ_CHAR_HANDLE, use_cached=1)).hex()
                     except Exception as e:
                         LOG.warning("Read failed: %s", e)
                         break
+                    t_mono = CLOCK.capture()
 
                     try:
                         prepared = dec.decode(raw)
+                        if FRAME_DEBUG:
+                            frame(address, t_mono, int(prepared, 2), len(prepared))
                         digi = dec.printdigit(prepared)
                         char = dec.printchar(prepared)
                         func = ' '.join(char[0]).strip()
                         unit = ' '.join(char[1]).strip()
-                        ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
-
-                        latest.update({
-                            "timestamp": ts,
-                            "value": digi,
-                            "unit": unit,
-                            "functions": func,
-                            "connected": True,
-                        })
-
-                        await broadcast(make_payload())
+                        await publish(
+                            address,
+                            t_mono_ns=t_mono,
+                            t_wall_ns=CLOCK.to_wall_ns(t_mono),
+                            value=digi,
+                            unit=unit,
+                            functions=func,
+                            connected=True,
+                        )
                     except Exception as e:
                         LOG.exception("Decode error: %s", e)
 
-                    await asyncio.sleep(period)
+                    # Fixed-rate schedule: sleep until the next slot instead of a
+                    # full period after the (variable) read + decode time
+                    next_due += period_ns
+                    now = CLOCK.capture()
+                    if next_due < now:
+                        next_due = now
+                    await asyncio.sleep((next_due - now) / 1e9)
 
         except Exception as e:
-            latest["connected"] = False
+            if address is not None:
+                status(address, connected=False)
             LOG.warning("BLE connection error: %s (retrying in 2s)", e)
+            failures += 1
+            if by_name and address is not None and failures >= 3:
+                # The cached address may be stale (e.g. a rotated random address)
+                discovery.cache.forget(address)
+                failures = 0
             await asyncio.sleep(2.0)
 
     LOG.info("BLE reader stopped")
 
+# ======= Shard workers (SHARDS) =======
+
+def shard_worker(ring_name, addresses, adapter=None):
+    """Entry point of a shard process: readers for `addresses` feeding one ring."""
+    try:
+        asyncio.run(_shard_worker(ring_name, addresses, adapter))
+    except KeyboardInterrupt:
+        pass
+
+async def _shard_worker(ring_name, addresses, adapter):
+    ring = SampleRing.attach(ring_name)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async def on_sample(address, **fields):
+        ring.write_sample(address, **fields)
+
+    ble_factory = functools.partial(BleakClient, adapter=adapter) if adapter else BleakClient
+    readers = []
+    for address in addresses:
+        simulated = address.startswith("SIM:")
+        readers.append(ble_reader(
+            stop_event, address,
+            client_factory=SimulatedClient if simulated else ble_factory,
+            poll_hz=SIMULATED_POLL_HZ if simulated else POLL_HZ,
+            cache=None if simulated else discovery.cache,
+            on_sample=on_sample, on_status=ring.write_status, on_frame=ring.write_frame,
+        ))
+    LOG.info("Shard worker for %d meters (adapter %s)", len(addresses), adapter or "default")
+    try:
+        await asyncio.gather(*readers)
+    finally:
+        ring.close()
+
+async def shard_pump(stop_event: asyncio.Event, ring: SampleRing):
+    """Feed samples from a shard's ring into the normal publish path."""
+    lost = 0
+    while not stop_event.is_set():
+        n = 0
+        for kind, address, fields in ring.read():
+            n += 1
+            try:
+                if kind == SAMPLE:
+                    await publish_sample(address, **fields)
+                elif kind == FRAME:
+                    observe_frame(address, **fields)
+                else:
+                    set_latest(address, **fields)
+            except Exception:
+                # One bad record must not stop the shard's pump
+                LOG.exception("Failed to publish a sample from %s", address)
+        if ring.lost != lost:
+            LOG.warning("Shard ring %s overran, %d samples lost", ring.name, ring.lost - lost)
+            lost = ring.lost
+        await asyncio.sleep(0 if n else SHARD_POLL_S)
+
+def start_shards(stop_event: asyncio.Event):
+    shard_devices = {}  # shard name -> addresses
+
+    def shard_exited(name, _exitcode):
+        # Nobody reports for these meters until the restarted worker connects
+        for address in shard_devices[name]:
+            if devices.get(address, {}).get("connected"):
+                set_latest(address, connected=False)
+
+    sim_index = 0
+    for i, shard in enumerate(SHARDS):
+        addresses = list(shard.get("devices", ()))
+        for _ in range(shard.get("simulated", 0)):
+            addresses.append(sim_address(sim_index))
+            sim_index += 1
+        too_long = [a for a in addresses if len(a.encode("utf-8")) > ADDRESS_BYTES]
+        if too_long:
+            raise ValueError(f"SHARDS: addresses longer than {ADDRESS_BYTES} bytes "
+                             f"do not fit the shard ring: {', '.join(too_long)}")
+        shard_devices[f"shard-{i}"] = addresses
+
+    supervisor = Supervisor(shard_worker, on_exit=shard_exited)
+    rings, tasks = [], []
+    for (name, addresses), shard in zip(shard_devices.items(), SHARDS):
+        ring = SampleRing.create(SHARD_RING_SLOTS)
+        rings.append(ring)
+        supervisor.add(name, ring.name, addresses, shard.get("adapter"))
+        tasks.append(asyncio.create_task(shard_pump(stop_event, ring)))
+    tasks.append(asyncio.create_task(supervisor.run(stop_event)))
+    LOG.info("Running %d shard processes", len(SHARDS))
+    return rings, tasks
+
 # ======= Web server (aiohttp) =======
 
 DASHBOARD_HTML = """
@@ -480,83 +832,157 @@ DASHBOARD_HTML = """
     }
   }
 
+  // Follow ?device=<address>, otherwise the first meter that reports
+  let device=new URLSearchParams(location.search).get('device');
+  const devQuery=()=> device ? '?device='+encodeURIComponent(device) : '';
+
   async function loadLatest(){
     try{
-      const r=await fetch('/api/latest',{cache:'no-store'});
+      const r=await fetch('/api/latest'+devQuery(),{cache:'no-store'});
       if(!r.ok) return;
       render(await r.json());
     }catch(e){}
   }
 
-  let data=[];    // {t,y}
+  // Samples live in a ring of typed arrays (absolute sample numbers n map to
+  // slot n % CAP). A monotonic deque of sample numbers with decreasing
+  // values gives the running max of the window in O(1) amortized.
+  const WIN=60, CAP=8192;
+  const ts=new Float64Array(CAP), ys=new Float64Array(CAP);
+  let first=0, next=0;                          // oldest / next sample number
+  const mq=new Float64Array(CAP); let mqHead=0, mqLen=0;
   let YMAX=1;
   const SMOOTH=0.18;
 
+  function evictOldest(){
+    if(mqLen && mq[mqHead]===first){ mqHead=(mqHead+1)%CAP; mqLen--; }
+    first++;
+  }
+  function push(t,y){
+    if(next-first===CAP) evictOldest();
+    ts[next%CAP]=t; ys[next%CAP]=y;
+    while(mqLen && ys[mq[(mqHead+mqLen-1)%CAP]%CAP]<=y) mqLen--;
+    mq[(mqHead+mqLen)%CAP]=next; mqLen++;
+    next++;
+  }
+  function evictBefore(cut){
+    while(next>first && ts[first%CAP]<cut) evictOldest();
+  }
+  const runningMax=()=> mqLen ? ys[mq[mqHead]%CAP] : 0;
+
+  // Background, grid and Y labels are drawn once into an offscreen layer and
+  // only rebuilt on resize or when the labels change
+  const gridLayer=document.createElement('canvas');
+  let gridKey='';
+  let dirty=true, lastCol=NaN, frameReq=0, tickTimer=0;
+
   function fit(){
     const dpr=window.devicePixelRatio||1;
     const r=chart.getBoundingClientRect();
-    chart.width=Math.floor(r.width*dpr);
-    chart.height=Math.floor(r.height*dpr);
+    chart.width=gridLayer.width=Math.floor(r.width*dpr);
+    chart.height=gridLayer.height=Math.floor(r.height*dpr);
+    gridKey='';
+    invalidate();
   }
-  addEventListener('resize',fit);
-  fit();
 
-  function draw(){
+  function layout(){
     const dpr=window.devicePixelRatio||1;
-    const ctx=chart.getContext('2d');
-    const W=chart.width, H=chart.height;
-
-    ctx.fillStyle='#1a1d29';
-    ctx.fillRect(0,0,W,H);
-
     const L=60*dpr, R=60*dpr, T=20*dpr, B=40*dpr;
-    const w=W-L-R, h=H-T-B;
+    return {dpr, L, T, w:chart.width-L-R, h:chart.height-T-B};
+  }
+
+  function drawGrid(g){
+    const labels=[];
+    for(let gy=0; gy<=6; gy++) labels.push((YMAX*(1-gy/6)).toFixed(1));
+    const key=labels.join('|');
+    if(key===gridKey) return;
+    gridKey=key;
 
+    const ctx=gridLayer.getContext('2d');
+    ctx.fillStyle='#1a1d29';
+    ctx.fillRect(0,0,gridLayer.width,gridLayer.height);
     ctx.save();
-    ctx.translate(L,T);
+    ctx.translate(g.L,g.T);
 
-    // Grid
     ctx.strokeStyle='#374151';
-    ctx.lineWidth=1*dpr;
+    ctx.lineWidth=1*g.dpr;
     ctx.beginPath();
-    for(let gx=0; gx<=10; gx++){ const x=w*gx/10; ctx.moveTo(x,0); ctx.lineTo(x,h); }
-    for(let gy=0; gy<=6; gy++){ const y=h*gy/6; ctx.moveTo(0,y); ctx.lineTo(w,y); }
+    for(let gx=0; gx<=10; gx++){ const x=g.w*gx/10; ctx.moveTo(x,0); ctx.lineTo(x,g.h); }
+    for(let gy=0; gy<=6; gy++){ const y=g.h*gy/6; ctx.moveTo(0,y); ctx.lineTo(g.w,y); }
     ctx.stroke();
 
-    // Y labels
-    ctx.fillStyle='#e2e8f0';
-    ctx.font=`bold ${16*dpr}px JetBrains Mono, Consolas, monospace`;
+    ctx.font=`bold ${16*g.dpr}px JetBrains Mono, Consolas, monospace`;
     ctx.textAlign='right';
-    for(let gy=0; gy<=6; gy++){
-      const y=h*gy/6;
-      const vLab=(YMAX*(1-gy/6)).toFixed(1);
-      ctx.fillStyle='#00d4ff';
-      ctx.fillText(vLab, -12*dpr, y+6*dpr);
+    ctx.fillStyle='#00d4ff';
+    for(let gy=0; gy<=6; gy++) ctx.fillText(labels[gy], -12*g.dpr, g.h*gy/6+6*g.dpr);
+    ctx.restore();
+  }
+
+  function invalidate(){
+    dirty=true;
+    if(!frameReq) frameReq=requestAnimationFrame(draw);
+  }
+
+  function draw(){
+    frameReq=0;
+    const g=layout();
+    if(g.w<=0 || g.h<=0) return;
+    // The line scrolls with time; it only visibly moves once per pixel column
+    const colSec=WIN/g.w, now=Date.now()/1000;
+    // Without new samples the line scrolls out; once it is gone, stop ticking
+    evictBefore(now-WIN);
+    const col=Math.floor(now/colSec);
+    if(dirty || col!==lastCol){
+      dirty=false; lastCol=col;
+      drawChart(g, now);
     }
+    clearTimeout(tickTimer);
+    if(next>first) tickTimer=setTimeout(invalidate, ((col+1)*colSec-now)*1000);
+  }
+
+  function drawChart(g, now){
+    drawGrid(g);
+    const ctx=chart.getContext('2d');
+    ctx.drawImage(gridLayer,0,0);
 
-    const now=Date.now()/1000, win=60, t0=now-win;
-    const mapX=t=> (t-t0)/win * w;
+    const t0=now-WIN, w=g.w, h=g.h;
     const mapY=y=> (1 - Math.min(1, Math.max(0, y/YMAX))) * h;
 
-    // Line
-    const LWmain = Math.max(4*dpr, 4);
+    ctx.save();
+    ctx.translate(g.L,g.T);
     ctx.lineJoin='round'; ctx.lineCap='round';
     ctx.strokeStyle='#00d4ff';
-    ctx.lineWidth=LWmain;
+    ctx.lineWidth=Math.max(4*g.dpr, 4);
     ctx.beginPath();
-    let started=false;
-    for(const p of data){
-      const x=mapX(p.t);
+
+    // Decimate to at most first/min/max/last per pixel column
+    let started=false, cx=-1, yFirst=0, yMin=0, yMax=0, yLast=0;
+    const to=v=>{
+      const y=mapY(v);
+      if(!started){ ctx.moveTo(cx,y); started=true; } else { ctx.lineTo(cx,y); }
+    };
+    const flush=()=>{ to(yFirst); if(yMin!==yMax){ to(yMin); to(yMax); to(yLast); } };
+    for(let n=first; n<next; n++){
+      const i=n%CAP;
+      const x=Math.round((ts[i]-t0)/WIN*w);
       if(x<0) continue;
-      const y=mapY(p.y);
-      if(!started){ ctx.moveTo(x,y); started=true; } else { ctx.lineTo(x,y); }
+      const y=ys[i];
+      if(x!==cx){
+        if(cx>=0) flush();
+        cx=x; yFirst=yMin=yMax=yLast=y;
+      }else{
+        if(y<yMin) yMin=y;
+        if(y>yMax) yMax=y;
+        yLast=y;
+      }
     }
+    if(cx>=0) flush();
     ctx.stroke();
-
     ctx.restore();
-    requestAnimationFrame(draw);
   }
-  requestAnimationFrame(draw);
+
+  addEventListener('resize',fit);
+  fit();
 
   function render(j){
     valueEl.textContent = j.value ?? '—';
@@ -565,24 +991,31 @@ DASHBOARD_HTML = """
 
     const y=parseFloat(j.value);
     if(!isNaN(y)){
-      const now=Date.now()/1000, win=60, cut=now-win;
-      data.push({t:now, y});
-      while(data.length && data[0].t < cut) data.shift();
+      const now=Date.now()/1000;
+      push(now, y);
+      evictBefore(now-WIN);
 
-      let m=0; for(const p of data){ if(p.y>m) m=p.y; }
-      const target=Math.max(1, Math.ceil(m*1.1*100)/100);
+      const target=Math.max(1, Math.ceil(Math.max(0, runningMax())*1.1*100)/100);
       YMAX += (target - YMAX) * SMOOTH;
 
       if(ymax) ymax.textContent = `Max: ${YMAX.toFixed(2)} ${j.unit||''}`;
+      invalidate();
     }
 
-    if(meta) meta.textContent = `Live multimeter • ${data.length} samples • Auto-scaling`;
+    if(meta) meta.textContent = `Live multimeter • ${next-first} samples • Auto-scaling`;
     document.title = (j.value ? `${j.value}${j.unit?' '+j.unit:''} – ` : '') + 'Multimeter';
   }
 
   loadLatest();
-  const evt=new EventSource('/stream');
-  evt.onmessage = ev => { try{ render(JSON.parse(ev.data)); }catch(_){} };
+  const evt=new EventSource('/stream'+devQuery());
+  evt.onmessage = ev => {
+    try{
+      const j=JSON.parse(ev.data);
+      // Follow the first meter that actually reports, not the placeholder state
+      if(!device && j.t_wall_ns!=null) device=j.target_addr;
+      if(j.target_addr===device) render(j);
+    }catch(_){}
+  };
   evt.onerror = ()=>{};
 </script>
 </body>
@@ -593,13 +1026,190 @@ DASHBOARD_HTML = """
 async def handle_index(_req):
     return web.Response(text=DASHBOARD_HTML, content_type="text/html", charset="utf-8")
 
-async def handle_latest(_req):
-    return web.json_response(make_payload())
+def _known_seq(request):
+    # Sequence number the client already has: ?since= or If-None-Match,
+    # either "<boot>-<seq>" as in the ETag or a bare seq
+    since = request.query.get("since")
+    if since is None:
+        since = request.headers.get("If-None-Match", "").strip().strip('"')
+    boot, _, n = since.rpartition("-")
+    if boot and boot != BOOT:
+        return None  # from before a restart, seq started over
+    try:
+        return int(n)
+    except ValueError:
+        return None
+
+def _requested_state(request):
+    address = request.query.get("device")
+    state = get_state(address)
+    if state is None:
+        raise web.HTTPNotFound(text=f"Unknown device {address}")
+    return address, state
+
+async def handle_latest(request):
+    address, state = _requested_state(request)
+    known = _known_seq(request)
+    wait = request.query.get("wait")
+    if wait is not None and known is not None and known >= state["seq"]:
+        try:
+            timeout = min(max(float(wait), 0.0), LONGPOLL_MAX_S)
+        except ValueError:
+            raise web.HTTPBadRequest(text="wait must be a number of seconds")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Every update wakes all waiters; keep waiting until this meter
+        # (or, without ?device=, any meter) has something newer
+        while known >= get_state(address)["seq"]:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(new_sample.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        state = get_state(address)
+
+    headers = {"ETag": state_etag(state), "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=latest_json(state), content_type="application/json", headers=headers)
+
+def _query_ns(request, name):
+    # Epoch seconds in the query string -> epoch ns
+    v = request.query.get(name)
+    if v is None:
+        return None
+    try:
+        return int(float(v) * 1e9)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be epoch seconds")
+
+async def query_samples(address, since_ns=None, until_ns=None, limit=None):
+    # Recent samples come from memory; anything older from the recordings
+    # on disk (archives and not yet compacted segments), but only for a
+    # bounded request: ?since= or ?limit=
+    samples = history.query(address, since_ns, until_ns, limit)
+    if RECORD_DIR is None or (since_ns is None and limit is None) or \
+            (limit is not None and len(samples) >= limit):
+        return samples
+    oldest = history.oldest_ns(address)
+    if oldest is not None and since_ns is not None and since_ns >= oldest:
+        return samples
+    disk_until = oldest - 1 if oldest is not None else until_ns
+    if until_ns is not None and disk_until is not None:
+        disk_until = min(disk_until, until_ns)
+    loop = asyncio.get_running_loop()
+    older = await loop.run_in_executor(
+        None, archive.query, RECORD_DIR, address, since_ns, disk_until,
+        None if limit is None else limit - len(samples))
+    return older + samples
+
+def _history_args(request):
+    address = request.query.get("device", latest["target_addr"])
+    try:
+        limit = int(request.query["limit"]) if "limit" in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be an integer")
+    return address, _query_ns(request, "since"), _query_ns(request, "until"), limit
+
+async def handle_history(request):
+    address, since_ns, until_ns, limit = _history_args(request)
+    samples = await query_samples(address, since_ns, until_ns, limit)
+    return web.json_response({"device": address, "samples": samples})
+
+async def handle_export(request):
+    address, since_ns, until_ns, limit = _history_args(request)
+    samples = await query_samples(address, since_ns, until_ns, limit)
+    channels = sorted({k for r in samples for k in (r.get("derived") or {})})
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(["timestamp", "t_wall_ns", "value", "unit", "functions", *channels])
+    for r in samples:
+        derived = r.get("derived") or {}
+        w.writerow([format_wall(r["t_wall_ns"]), r["t_wall_ns"], r["value"], r["unit"],
+                    r["functions"], *(derived.get(ch) for ch in channels)])
+    filename = "dmm-" + address.replace(":", "") + ".csv"
+    return web.Response(
+        text=out.getvalue(), content_type="text/csv", charset="utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+def _query_list(request, name):
+    v = request.query.get(name)
+    return None if v is None else {x.strip() for x in v.split(",") if x.strip()}
+
+async def handle_distribution(request):
+    units = _query_list(request, "unit")
+    try:
+        qs = [float(q) for q in request.query.get("q", "0.5,0.95,0.99").split(",")]
+        bins = int(request.query.get("bins", 20))
+        every = int(request.query["every"]) if "every" in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text="q, bins and every must be numbers")
+    if not all(0 <= q <= 1 for q in qs) or not 1 <= bins <= 1000 or (every is not None and every <= 0):
+        raise web.HTTPBadRequest(text="q must be in [0, 1], bins in [1, 1000], every > 0")
+    since, until = _query_ns(request, "since"), _query_ns(request, "until")
+    if every is not None:
+        every = max(every // DISTRIBUTION_BUCKET_S, 1) * DISTRIBUTION_BUCKET_S
+    merged = distributions.query(
+        devices=_query_list(request, "device"),
+        quantities=None if units is None else {quantity(u) for u in units},
+        sessions=_query_list(request, "session"),
+        since_s=None if since is None else since // 1_000_000_000,
+        until_s=None if until is None else until // 1_000_000_000,
+        every_s=every,
+    )
+    if every is None:
+        result = {q: s.report(qs, bins) for q, s in merged.items()}
+    else:
+        result = {q: [{"t": t, **s.report(qs, bins)} for t, s in sorted(series.items())]
+                  for q, series in merged.items()}
+    return web.json_response({
+        "session": distributions.session,
+        "sessions": distributions.sessions(),
+        "bucket_s": DISTRIBUTION_BUCKET_S,
+        "every_s": every,
+        "quantities": result,
+    })
+
+async def handle_distribution_session(request):
+    """Start a new measurement session (?name=, default: the current time)."""
+    name = distributions.new_session(request.query.get("name"))
+    LOG.info("Distribution session %s", name)
+    data = distributions.snapshot()
+    await asyncio.get_running_loop().run_in_executor(None, distributions.write, data)
+    return web.json_response({"session": name})
+
+async def handle_devices(_req):
+    return web.json_response([latest_payload(state) for state in devices.values()])
+
+async def handle_sinks(_req):
+    return web.json_response([sink.stats() for sink in sinks])
 
 async def handle_stream(request):
+    address, state = _requested_state(request)
+    return await _serve_sse(request, sse_clients, address,
+                            [f"data: {latest_json(state).decode('utf-8')}\n\n"])
+
+async def handle_debug(request):
+    address = request.query.get("device", latest["target_addr"])
+    if address not in frame_trackers:
+        raise web.HTTPNotFound(text=f"No frames from {address} yet" if FRAME_DEBUG else "FRAME_DEBUG is off")
+    return web.json_response(debug_snapshot(address))
+
+async def handle_debug_stream(request):
+    """Bits that changed per frame; starts with the bits currently set."""
+    address = request.query.get("device")
+    first = [frame_event(a, tr.t_mono_ns, tr.active(), [], first=True)
+             for a, tr in frame_trackers.items() if address is None or a == address]
+    return await _serve_sse(request, debug_clients, address, first)
+
+async def _serve_sse(request, clients, address, first_events):
     q: asyncio.Queue[str] = asyncio.Queue()
-    sse_clients.add(q)
-    await q.put(f"data: {json.dumps(make_payload())}\n\n")
+    clients[q] = address
+    for data in first_events:
+        await q.put(data)
 
     resp = web.StreamResponse(
         status=200,
@@ -621,23 +1231,114 @@ async def handle_stream(request):
     except (asyncio.CancelledError, ConnectionResetError, BrokenPipeError):
         pass
     finally:
-        sse_clients.discard(q)
+        clients.pop(q, None)
         try:
             await resp.write_eof()
         except Exception:
             pass
     return resp
 
+# ======= Admin diagnostics (ADMIN_TOKEN) =======
+
+profiler = None  # SamplingProfiler while /admin/profile runs
+memory_tracer = MemoryTracer()
+task_watch = TaskWatch()
+
+def _check_admin(request):
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")):
+        raise web.HTTPUnauthorized(text="admin token required")
+
+def _query_number(request, name, default, cast=float):
+    try:
+        x = cast(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be a number")
+    if not math.isfinite(x):
+        raise web.HTTPBadRequest(text=f"{name} must be finite")
+    return x
+
+async def handle_admin_profile(request):
+    """Profile for ?seconds= (?hz=, ?mode=cpu|wall, ?idle), return collapsed stacks."""
+    global profiler
+    _check_admin(request)
+    seconds = min(max(_query_number(request, "seconds", 10), 0.1), PROFILE_MAX_S)
+    if profiler is not None:
+        raise web.HTTPConflict(text="a profile is already running")
+    hz = min(max(_query_number(request, "hz", 100), 1.0), PROFILE_MAX_HZ)
+    try:
+        candidate = SamplingProfiler(hz, "idle" in request.query, request.query.get("mode", "cpu"))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    profiler = candidate
+    try:
+        candidate.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            candidate.stop()
+    finally:
+        profiler = None
+    return web.Response(
+        text=candidate.collapsed(), content_type="text/plain", charset="utf-8",
+        headers={"Content-Disposition": 'attachment; filename="bridge.collapsed"'},
+    )
+
+async def handle_admin_memory_start(request):
+    _check_admin(request)
+    memory_tracer.start(_query_number(request, "frames", 1, int))
+    return web.json_response({"tracing": True})
+
+async def handle_admin_memory_stop(request):
+    _check_admin(request)
+    memory_tracer.stop()
+    return web.json_response({"tracing": False})
+
+async def handle_admin_memory(request):
+    """Top allocation sites and the diff against the previous call."""
+    _check_admin(request)
+    if not memory_tracer.tracing:
+        raise web.HTTPConflict(text="POST /admin/memory/start first")
+    limit = _query_number(request, "limit", 25, int)
+    key = request.query.get("group", "lineno")
+    if key not in ("lineno", "filename", "traceback"):
+        raise web.HTTPBadRequest(text="group must be lineno, filename or traceback")
+    report = await asyncio.get_running_loop().run_in_executor(
+        None, memory_tracer.snapshot, limit, key)
+    # The usual suspect for growth: subscribers that stopped reading
+    sizes = [q.qsize() for q in sse_clients]
+    report["sse_clients"] = {"count": len(sizes), "queued": sum(sizes), "max_queued": max(sizes, default=0)}
+    return web.json_response(report)
+
+async def handle_admin_tasks(request):
+    _check_admin(request)
+    return web.json_response(task_watch.dump())
+
 def make_app():
     app = web.Application()
     app.router.add_get("/", handle_index)
     app.router.add_get("/api/latest", handle_latest)
+    app.router.add_get("/api/devices", handle_devices)
+    app.router.add_get("/api/sinks", handle_sinks)
+    app.router.add_get("/api/history", handle_history)
+    app.router.add_get("/api/export", handle_export)
+    app.router.add_get("/api/distribution", handle_distribution)
+    app.router.add_post("/api/distribution/session", handle_distribution_session)
     app.router.add_get("/stream", handle_stream)
+    app.router.add_get("/api/debug", handle_debug)
+    app.router.add_get("/api/debug/stream", handle_debug_stream)
+    if ADMIN_TOKEN:
+        app.router.add_post("/admin/profile", handle_admin_profile)
+        app.router.add_post("/admin/memory/start", handle_admin_memory_start)
+        app.router.add_post("/admin/memory/stop", handle_admin_memory_stop)
+        app.router.add_get("/admin/memory", handle_admin_memory)
+        app.router.add_get("/admin/tasks", handle_admin_tasks)
     return app
 
 # ======= Main runner =======
 
 async def main():
+    global recorder
     stop_event = asyncio.Event()
     loop = asyncio.get_running_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
@@ -646,7 +1347,73 @@ async def main():
         except NotImplementedError:
             pass
 
-    ble_task = asyncio.create_task(ble_reader(stop_event))
+    try:
+        DerivedPipeline(DERIVED_CHANNELS)  # a bad entry fails here, not on every sample
+    except ValueError as e:
+        raise SystemExit(f"DERIVED_CHANNELS: {e}")
+
+    if RECORD_DIR:
+        recorder = Recorder(RECORD_DIR, RECORD_SEGMENT_S)
+        if ARCHIVE_SEGMENTS:
+            # Leftovers from earlier runs first, then every segment closed by rotation
+            loop.run_in_executor(None, archive.compact_closed_segments,
+                                 RECORD_DIR, RECORD_SEGMENT_S, ARCHIVE_KEEP_JSONL)
+            recorder.on_close.append(lambda path: loop.run_in_executor(
+                None, archive.compact_segment, path, ARCHIVE_KEEP_JSONL))
+
+    rings = []
+    if SHARDS:
+        rings, reader_tasks = start_shards(stop_event)
+    elif SIMULATED_DEVICES:
+        LOG.info("Simulating %d meters at %.1f Hz", SIMULATED_DEVICES, SIMULATED_POLL_HZ)
+        reader_tasks = [
+            asyncio.create_task(ble_reader(
+                stop_event, sim_address(i),
+                client_factory=SimulatedClient, poll_hz=SIMULATED_POLL_HZ))
+            for i in range(SIMULATED_DEVICES)
+        ]
+    elif BLE_ENABLED and DISCOVERY_WATCH:
+        reader_tasks = []
+        attached = set()
+
+        def attach(address, _name=None):
+            if address not in attached:
+                attached.add(address)
+                reader_tasks.append(asyncio.create_task(
+                    ble_reader(stop_event, address, cache=discovery.cache)))
+
+        if not is_placeholder(TARGET_ADDR_STR):
+            attach(TARGET_ADDR_STR)
+        for address in discovery.cache.known():
+            attach(address)  # meters from the cache start without waiting for a scan
+        reader_tasks.append(asyncio.create_task(discovery.watch(stop_event, attach)))
+    elif BLE_ENABLED:
+        reader_tasks = [asyncio.create_task(ble_reader(stop_event, cache=discovery.cache))]
+    else:
+        reader_tasks = []
+
+    if ESP32_ENDPOINTS:
+        poller = Esp32Poller(
+            ESP32_ENDPOINTS,
+            on_sample=publish_sample,
+            on_status=lambda address, ok: set_latest(address, target_name="ESP32", connected=ok),
+            clock=CLOCK,
+            min_interval=ESP32_MIN_INTERVAL_S,
+            max_interval=ESP32_MAX_INTERVAL_S,
+            timeout=ESP32_TIMEOUT_S,
+        )
+        LOG.info("Polling %d ESP32 bridges", len(ESP32_ENDPOINTS))
+        reader_tasks.append(asyncio.create_task(poller.run(stop_event)))
+
+    for url in SINK_URLS:
+        sinks.append(make_sink(
+            url,
+            batch_size=SINK_BATCH_SIZE,
+            linger=SINK_LINGER_S,
+            queue_size=SINK_QUEUE_SIZE,
+            drop=SINK_DROP,
+        ))
+    sink_tasks = [asyncio.create_task(sink.run(stop_event)) for sink in sinks]
 
     app = make_app()
     runner = web.AppRunner(app)
@@ -658,13 +1425,20 @@ async def main():
     await stop_event.wait()
     LOG.info("Shutting down...")
 
-    ble_task.cancel()
-    try:
-        await ble_task
-    except asyncio.CancelledError:
-        pass
+    for task in reader_tasks:
+        task.cancel()
+    await asyncio.gather(*reader_tasks, return_exceptions=True)
+    for ring in rings:
+        ring.close()
+
+    for task in sink_tasks:
+        task.cancel()
+    await asyncio.gather(*sink_tasks, return_exceptions=True)
 
     await runner.cleanup()
+    if recorder is not None:
+        recorder.close()
+    distributions.save()
     LOG.info("Bye")
 
 if __name__ == "__main__":
@@ -0,0 +1,420 @@
+"""Compressed long-term archive for recorded DMM samples
+
+Closed JSON-lines segments written by history.Recorder are compacted into
+.dmma files made of Gorilla-style blocks (one meter, up to BLOCK_SAMPLES
+consecutive samples each):
+
+- timestamps   delta-of-delta, millisecond resolution: a steady sample
+               rate costs 1 bit per sample
+- values       XOR against the previous float64: a repeated reading costs
+               1 bit, small changes only their meaningful bits
+- flags        unit / functions / display format as run-length encoded
+               runs over a small per-block dictionary
+- derived      every derived channel is an extra XOR-encoded series
+
+A block index at the end of each file holds device and time range per
+block, so a range query reads and decodes only the blocks it touches.
+query() reads archives and not yet compacted segments alike, which lets
+the bridge's history and export APIs look through to disk transparently.
+
+File layout:
+  block*  := u32 meta_len | meta (JSON) | u32 bits_len | bitstream
+  index   := JSON list of {device, t0, t1, n, offset}
+  trailer := u64 index_offset | u32 index_len | MAGIC
+
+Requires: nothing beyond the standard library
+"""
+import glob
+import json
+import logging
+import math
+import os
+import struct
+import time
+from datetime import datetime
+
+LOG = logging.getLogger("ble_dmm_archive")
+
+MAGIC = b"DMMA"
+TRAILER = struct.Struct("<QI4s")
+U32 = struct.Struct("<I")
+BLOCK_SAMPLES = 1024
+TIME_UNIT_NS = 1_000_000  # archived timestamps are kept in milliseconds
+
+# Payload bits of the delta-of-delta buckets with prefixes 10, 110, 1110,
+# 11110 and 11111; a zero delta-of-delta is the single bit 0
+DOD_BITS = (7, 9, 12, 32, 64)
+
+
+# ======= Bit streams =======
+
+class BitWriter:
+    def __init__(self):
+        self.buf = bytearray()
+        self.acc = 0
+        self.nacc = 0
+
+    def write(self, value, nbits):
+        self.acc = (self.acc << nbits) | (value & ((1 << nbits) - 1))
+        self.nacc += nbits
+        while self.nacc >= 8:
+            self.nacc -= 8
+            self.buf.append((self.acc >> self.nacc) & 0xFF)
+        self.acc &= (1 << self.nacc) - 1
+
+    def getvalue(self) -> bytes:
+        if self.nacc:
+            return bytes(self.buf) + bytes([(self.acc << (8 - self.nacc)) & 0xFF])
+        return bytes(self.buf)
+
+
+class BitReader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+        self.acc = 0
+        self.nacc = 0
+
+    def read(self, nbits):
+        while self.nacc < nbits:
+            self.acc = (self.acc << 8) | self.data[self.pos]
+            self.pos += 1
+            self.nacc += 8
+        self.nacc -= nbits
+        value = self.acc >> self.nacc
+        self.acc &= (1 << self.nacc) - 1
+        return value
+
+    def read_signed(self, nbits):
+        v = self.read(nbits)
+        return v - (1 << nbits) if v >> (nbits - 1) else v
+
+
+# ======= Gorilla codecs =======
+
+def encode_times(w: BitWriter, times):
+    prev, prev_delta = times[0], 0
+    for t in times[1:]:
+        delta = t - prev
+        dod = delta - prev_delta
+        if dod == 0:
+            w.write(0, 1)
+        else:
+            for k, bits in enumerate(DOD_BITS):
+                if k == len(DOD_BITS) - 1:
+                    w.write(0b11111, 5)
+                    break
+                if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+                    w.write(((1 << (k + 1)) - 1) << 1, k + 2)
+                    break
+            w.write(dod, bits)
+        prev, prev_delta = t, delta
+
+
+def decode_times(r: BitReader, t0, n):
+    times = [t0]
+    prev, prev_delta = t0, 0
+    for _ in range(n - 1):
+        ones = 0
+        while ones < len(DOD_BITS) and r.read(1):
+            ones += 1
+        dod = r.read_signed(DOD_BITS[ones - 1]) if ones else 0
+        prev_delta += dod
+        prev += prev_delta
+        times.append(prev)
+    return times
+
+
+def _float_bits(x) -> int:
+    return struct.unpack("<Q", struct.pack("<d", x))[0]
+
+
+def _bits_float(b) -> float:
+    return struct.unpack("<d", struct.pack("<Q", b))[0]
+
+
+def encode_values(w: BitWriter, values):
+    prev = _float_bits(values[0])
+    w.write(prev, 64)
+    lead, trail = 65, 0  # no window yet
+    for x in values[1:]:
+        cur = _float_bits(x)
+        xor = cur ^ prev
+        prev = cur
+        if xor == 0:
+            w.write(0, 1)
+            continue
+        w.write(1, 1)
+        new_lead = min(64 - xor.bit_length(), 31)
+        new_trail = (xor & -xor).bit_length() - 1
+        if new_lead >= lead and new_trail >= trail:
+            # Fits the previous meaningful-bit window
+            w.write(0, 1)
+            w.write(xor >> trail, 64 - lead - trail)
+        else:
+            lead, trail = new_lead, new_trail
+            size = 64 - lead - trail
+            w.write(1, 1)
+            w.write(lead, 5)
+            w.write(size & 63, 6)  # 64 is stored as 0
+            w.write(xor >> trail, size)
+
+
+def decode_values(r: BitReader, n):
+    prev = r.read(64)
+    values = [_bits_float(prev)]
+    lead = trail = 0
+    for _ in range(n - 1):
+        if r.read(1) == 1:
+            if r.read(1) == 1:
+                lead = r.read(5)
+                size = r.read(6) or 64
+                trail = 64 - lead - size
+            prev ^= r.read(64 - lead - trail) << trail
+        values.append(_bits_float(prev))
+    return values
+
+
+# ======= Records <-> blocks =======
+
+def _display_format(value):
+    """(float, fmt): fmt is the decimal count, or the literal text if not numeric."""
+    if value is None:
+        return math.nan, None
+    try:
+        x = float(value)
+    except ValueError:
+        return math.nan, value
+    decimals = len(value.split(".", 1)[1]) if "." in value else 0
+    if f"{x:.{decimals}f}" == value:
+        return x, decimals
+    return math.nan, value
+
+
+def _display_text(x, fmt):
+    if fmt is None or isinstance(fmt, str):
+        return fmt
+    return f"{x:.{fmt}f}"
+
+
+def _num(v):
+    return math.nan if v is None else float(v)
+
+
+def encode_block(device, records) -> bytes:
+    times = [r["t_wall_ns"] // TIME_UNIT_NS for r in records]
+    values, flag_ids, flags, runs = [], {}, [], []
+    channels = sorted({k for r in records for k in (r.get("derived") or {})})
+    for r in records:
+        x, fmt = _display_format(r.get("value"))
+        values.append(x)
+        key = (r.get("unit") or "", r.get("functions") or "", fmt)
+        idx = flag_ids.get(key)
+        if idx is None:
+            idx = flag_ids[key] = len(flags)
+            flags.append(list(key))
+        if runs and runs[-1][0] == idx:
+            runs[-1][1] += 1
+        else:
+            runs.append([idx, 1])
+
+    w = BitWriter()
+    encode_times(w, times)
+    encode_values(w, values)
+    for ch in channels:
+        encode_values(w, [_num((r.get("derived") or {}).get(ch)) for r in records])
+    bits = w.getvalue()
+
+    meta = json.dumps({
+        "device": device, "n": len(records), "t0": times[0], "t1": times[-1],
+        "channels": channels, "flags": flags, "runs": runs,
+    }, separators=(",", ":")).encode("utf-8")
+    return U32.pack(len(meta)) + meta + U32.pack(len(bits)) + bits
+
+
+def decode_block(data: bytes):
+    (meta_len,) = U32.unpack_from(data, 0)
+    meta = json.loads(data[4:4 + meta_len])
+    (bits_len,) = U32.unpack_from(data, 4 + meta_len)
+    r = BitReader(data[8 + meta_len:8 + meta_len + bits_len])
+    n = meta["n"]
+    times = decode_times(r, meta["t0"], n)
+    values = decode_values(r, n)
+    derived = {ch: decode_values(r, n) for ch in meta["channels"]}
+
+    records = []
+    i = 0
+    for idx, count in meta["runs"]:
+        unit, functions, fmt = meta["flags"][idx]
+        for _ in range(count):
+            records.append({
+                "device": meta["device"],
+                "t_wall_ns": times[i] * TIME_UNIT_NS,
+                "t_mono_ns": None,
+                "value": _display_text(values[i], fmt),
+                "unit": unit,
+                "functions": functions,
+                "derived": {ch: (None if math.isnan(v[i]) else v[i]) for ch, v in derived.items()},
+            })
+            i += 1
+    return records
+
+
+# ======= Files =======
+
+def archive_path(segment_path):
+    return os.path.splitext(segment_path)[0] + ".dmma"
+
+
+def read_segment(path):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass  # torn last line after a crash
+    return records
+
+
+def read_archive(path):
+    records = []
+    with open(path, "rb") as f:
+        index, index_offset = read_index(f)
+        ends = [e["offset"] for e in index[1:]] + [index_offset]
+        for entry, end in zip(index, ends):
+            f.seek(entry["offset"])
+            records.extend(decode_block(f.read(end - entry["offset"])))
+    return records
+
+
+def compact_segment(path, keep_source=False):
+    """Compress a closed JSON-lines segment into a .dmma archive, merged
+    with the archive of the same segment if there already is one."""
+    records = read_segment(path)
+    out = archive_path(path)
+    if os.path.exists(out):
+        LOG.info("Merging %s into existing %s", os.path.basename(path), os.path.basename(out))
+        records = read_archive(out) + records
+    by_device = {}
+    for r in records:
+        # Keyed by archived time, so samples already in the archive (e.g. a
+        # kept source compacted twice) are not duplicated
+        by_device.setdefault(r["device"], {})[r["t_wall_ns"] // TIME_UNIT_NS] = r
+    tmp = out + ".tmp"
+    index = []
+    with open(tmp, "wb") as f:
+        for device, by_time in by_device.items():
+            series = [by_time[t] for t in sorted(by_time)]
+            for i in range(0, len(series), BLOCK_SAMPLES):
+                chunk = series[i:i + BLOCK_SAMPLES]
+                block = encode_block(device, chunk)
+                index.append({
+                    "device": device, "n": len(chunk), "offset": f.tell(),
+                    "t0": chunk[0]["t_wall_ns"] // TIME_UNIT_NS,
+                    "t1": chunk[-1]["t_wall_ns"] // TIME_UNIT_NS,
+                })
+                f.write(block)
+        index_offset = f.tell()
+        raw_index = json.dumps(index, separators=(",", ":")).encode("utf-8")
+        f.write(raw_index)
+        f.write(TRAILER.pack(index_offset, len(raw_index), MAGIC))
+    os.replace(tmp, out)
+    LOG.info("Archived %s (%d bytes) -> %s (%d bytes)", os.path.basename(path),
+             os.path.getsize(path), os.path.basename(out), os.path.getsize(out))
+    if not keep_source:
+        os.remove(path)
+    return out
+
+
+def read_index(f):
+    f.seek(-TRAILER.size, os.SEEK_END)
+    index_offset, index_len, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{f.name} is not a DMM archive")
+    f.seek(index_offset)
+    return json.loads(f.read(index_len)), index_offset
+
+
+def query_archive(path, device, since_ns=None, until_ns=None):
+    lo = -math.inf if since_ns is None else since_ns // TIME_UNIT_NS
+    hi = math.inf if until_ns is None else until_ns // TIME_UNIT_NS
+    out = []
+    with open(path, "rb") as f:
+        index, index_offset = read_index(f)
+        ends = [e["offset"] for e in index[1:]] + [index_offset]
+        for entry, end in zip(index, ends):
+            if entry["device"] != device or entry["t1"] < lo or entry["t0"] > hi:
+                continue
+            f.seek(entry["offset"])
+            for r in decode_block(f.read(end - entry["offset"])):
+                if (since_ns is None or r["t_wall_ns"] >= since_ns) and \
+                        (until_ns is None or r["t_wall_ns"] <= until_ns):
+                    out.append(r)
+    return out
+
+
+def query(directory, device, since_ns=None, until_ns=None, limit=None):
+    """Samples of one meter from archives and uncompacted segments, oldest
+    first. With limit only the newest `limit`: files are read newest first
+    and older ones are not opened once they cannot hold anything newer."""
+    segments = {}
+    for path in glob.glob(os.path.join(directory, "dmm-*.jsonl")) + \
+            glob.glob(os.path.join(directory, "dmm-*.dmma")):
+        # While a segment is being compacted both files exist; the archive wins
+        segments[os.path.splitext(path)[0]] = path
+    files = [segments[k] for k in sorted(segments)]
+    out = []
+    for i in reversed(range(len(files))):
+        path = files[i]
+        if until_ns is not None and _segment_start_ns(path) > until_ns:
+            continue
+        # Segment names sort by start time and the recorder only rotates
+        # forward, so the next file's start bounds every sample in this one
+        upper = _segment_start_ns(files[i + 1]) if i + 1 < len(files) else None
+        if upper is not None and since_ns is not None and upper <= since_ns:
+            break
+        if upper is not None and limit is not None and len(out) >= limit \
+                and upper <= out[-limit]["t_wall_ns"]:
+            break
+        try:
+            out.extend(_query_file(path, device, since_ns, until_ns))
+        except FileNotFoundError:
+            # Compacted (or pruned) since the glob; the archive replaces it
+            if not path.endswith(".dmma") and os.path.exists(archive_path(path)):
+                out.extend(_query_file(archive_path(path), device, since_ns, until_ns))
+        out.sort(key=lambda r: r["t_wall_ns"])
+        if limit is not None:
+            out = out[-limit:]
+    return out
+
+
+def _query_file(path, device, since_ns, until_ns):
+    if path.endswith(".dmma"):
+        return query_archive(path, device, since_ns, until_ns)
+    return [r for r in read_segment(path)
+            if r["device"] == device
+            and (since_ns is None or r["t_wall_ns"] >= since_ns)
+            and (until_ns is None or r["t_wall_ns"] <= until_ns)]
+
+
+def _segment_start_ns(path):
+    stamp = os.path.basename(path)[4:19]  # dmm-YYYYmmdd-HHMMSS.ext
+    return int(datetime.strptime(stamp, "%Y%m%d-%H%M%S").timestamp()) * 1_000_000_000
+
+
+def compact_closed_segments(directory, segment_s, keep_source=False):
+    """Compact every JSON-lines segment whose time span is over."""
+    done = []
+    now_ns = time.time_ns()
+    for path in sorted(glob.glob(os.path.join(directory, "dmm-*.jsonl"))):
+        if _segment_start_ns(path) + segment_s * 1_000_000_000 > now_ns:
+            continue  # still current; the recorder may append to it again
+        out = archive_path(path)
+        if os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(path):
+            continue  # kept source that is already archived
+        try:
+            done.append(compact_segment(path, keep_source))
+        except (OSError, ValueError) as e:
+            LOG.warning("Could not archive %s: %s", path, e)
+    return done
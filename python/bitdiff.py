@@ -0,0 +1,62 @@
+"""Bit-level change tracking for prepared DMM frames
+
+Keeps the previous prepared frame of each meter as one integer. A new
+frame is XORed against it and only the bits that flipped are reported,
+so the work per frame is one int() conversion plus a step per changed
+bit, cheap enough to run alongside normal acquisition.
+
+Bit indices count from the start of the prepared bit string, like the
+bit_indices of the firmware's /api/debug, so they line up with the
+decoder tables (e.g. 70 is "?5" for decoder_1).
+
+Requires: nothing beyond the standard library
+"""
+
+
+def set_bits(x: int, nbits: int) -> list:
+    """Indices (in bit-string order, ascending) of the bits set in x."""
+    out = []
+    while x:
+        low = x & -x
+        out.append(nbits - low.bit_length())
+        x ^= low
+    out.reverse()
+    return out
+
+
+class BitTracker:
+    def __init__(self):
+        self.bits = None
+        self.nbits = 0
+        self.toggles = []  # per bit: how often it flipped
+        self.frames = 0
+        self.changed_frames = 0
+        self.t_mono_ns = None
+
+    def update(self, bits: int, nbits: int, t_mono_ns=None):
+        """Bits switched (on, off) since the previous frame; None for the
+        first frame or after the frame length changed."""
+        self.frames += 1
+        self.t_mono_ns = t_mono_ns
+        if self.bits is None or nbits != self.nbits:
+            self.bits, self.nbits = bits, nbits
+            self.toggles = [0] * nbits
+            return None
+        diff = bits ^ self.bits
+        if not diff:
+            return [], []
+        on = set_bits(diff & bits, nbits)
+        off = set_bits(diff & self.bits, nbits)
+        for i in on:
+            self.toggles[i] += 1
+        for i in off:
+            self.toggles[i] += 1
+        self.bits = bits
+        self.changed_frames += 1
+        return on, off
+
+    def active(self) -> list:
+        return set_bits(self.bits or 0, self.nbits)
+
+    def bit_string(self) -> str:
+        return format(self.bits, f"0{self.nbits}b") if self.bits is not None else ""
@@ -1,7 +1,8 @@
 """Minimal BLE DMM client
 
 Connects to a single target device and prints decoded readings to the terminal.
-Configure TARGET_NAME or TARGET_ADDR_STR below.
+Configure TARGET_NAME or TARGET_ADDR_STR below; with the placeholder
+address the meter is found by name (see discovery.py, results are cached).
 Requires: bleak
 """
 import asyncio
@@ -11,6 +12,8 @@ import logging
 
 from bleak import BleakClient
 
+from discovery import Discovery, is_placeholder
+
 # --- Configuration: change these to your device ---
 TARGET_NAME = "Bluetooth DMM"
 TARGET_ADDR_STR = "XX:XX:XX:XX:XX:XX"  # e.g. "c4:a9:b8:3a:5d:bd"
@@ -160,6 +163,13 @@ class decoder_4(decoder_1):
 
 
 async def read_loop(address: str):
+    if is_placeholder(address):
+        print(f"Looking for {TARGET_NAME!r}...")
+        address = await Discovery(names=(TARGET_NAME,)).resolve(TARGET_NAME)
+        if address is None:
+            print("No meter found. Is it switched on and in Bluetooth mode?")
+            return
+        print(f"Found: {address}")
     async with BleakClient(address) as client:
         print(f"Connected: {client.is_connected}")
         # try to detect type
@@ -0,0 +1,48 @@
+"""Capture clock for BLE DMM samples
+
+Samples are stamped with time.monotonic_ns() the moment a read or
+notification completes. Monotonic stamps never jump when NTP adjusts the
+system clock, so differences between them are exact inter-sample deltas.
+Wall time is derived from the monotonic stamp through an offset that is
+re-measured every RECALIBRATE_S seconds, and only turned into a string
+where a human or a legacy client needs one (format_wall).
+
+Requires: nothing beyond the standard library
+"""
+import time
+from datetime import datetime
+
+RECALIBRATE_S = 60.0
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class CaptureClock:
+    def __init__(self, recalibrate_s=RECALIBRATE_S):
+        self.recalibrate_ns = int(recalibrate_s * 1e9)
+        self.offset_ns = 0
+        self._next_calibration = 0
+        self.calibrate()
+
+    def calibrate(self):
+        # Bracket the wall-clock read between two monotonic reads and use
+        # the midpoint, which halves the error from being preempted
+        m0 = time.monotonic_ns()
+        wall = time.time_ns()
+        m1 = time.monotonic_ns()
+        self.offset_ns = wall - (m0 + m1) // 2
+        self._next_calibration = m1 + self.recalibrate_ns
+
+    @staticmethod
+    def capture() -> int:
+        return time.monotonic_ns()
+
+    def to_wall_ns(self, mono_ns: int) -> int:
+        if mono_ns >= self._next_calibration:
+            self.calibrate()
+        return mono_ns + self.offset_ns
+
+
+def format_wall(wall_ns) -> str:
+    if wall_ns is None:
+        return None
+    return datetime.fromtimestamp(wall_ns / 1e9).strftime(TIMESTAMP_FORMAT)
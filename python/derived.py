@@ -0,0 +1,235 @@
+"""Derived channels for the BLE DMM bridge
+
+Turns the decoded display strings into numbers and computes extra series
+from them, sample by sample, in bounded memory per channel; every kind
+but median (O(window)) takes constant time per sample:
+
+  integrate   running trapezoidal integral, e.g. A -> Ah with scale=1/3600
+  derivative  rate of change per second
+  ema         exponential moving average (alpha, or time constant tau_s)
+  median      running median over the last `window` samples
+  expr        user-defined expression over value, dt and earlier channels
+
+Channels are configured as dicts, evaluated in order, per meter:
+
+  DERIVED_CHANNELS = [
+      {"name": "charge_Ah", "kind": "integrate", "unit": "A", "scale": 1/3600},
+      {"name": "power_W", "kind": "expr", "unit": "A", "expr": "value * 12.0"},
+      {"name": "energy_Wh", "kind": "integrate", "source": "power_W", "scale": 1/3600},
+      {"name": "smooth", "kind": "ema", "tau_s": 2.0},
+  ]
+
+"source" is "value" (the reading in base SI units) or an earlier channel;
+"unit" limits a channel to readings in that base unit, so integration
+pauses while the meter is switched to another range. A channel that
+raises (e.g. 1/value at 0) outputs None for that sample; the reading
+itself is never lost.
+
+Requires: nothing beyond the standard library
+"""
+import bisect
+import logging
+import math
+from collections import deque
+
+LOG = logging.getLogger("ble_dmm_derived")
+
+PREFIXES = {"n": 1e-9, "μ": 1e-6, "µ": 1e-6, "m": 1e-3, "k": 1e3, "K": 1e3, "M": 1e6}
+BASE_UNITS = ("V", "A", "Ω", "F", "Hz", "°C", "°F", "%")
+
+
+def parse_reading(value, unit):
+    """Display strings -> (value in base units or None, base unit)."""
+    tokens = (unit or "").split()
+    base = next((t for t in tokens if t in BASE_UNITS), "")
+    try:
+        x = float(value)
+    except (TypeError, ValueError):
+        return None, base  # "0L" overload, blank display, ...
+    for t in tokens:
+        if t in PREFIXES:
+            x *= PREFIXES[t]
+            break
+    return x, base
+
+
+class Channel:
+    def __init__(self, name, source="value", unit=None, max_gap_s=10.0):
+        self.name = name
+        self.source = source
+        self.unit = unit
+        self.max_gap_s = max_gap_s
+        self.value = None
+        self.errors = 0
+        self.reset()
+
+    def reset(self):
+        # Forget the previous point (not the output) across a gap
+        self.prev_t = None
+        self.prev_x = None
+
+    def restart(self):
+        # The meter switched to another quantity; integrals keep their total
+        self.reset()
+
+    def update(self, t, x):
+        dt = None if self.prev_t is None else t - self.prev_t
+        if dt is not None and (dt <= 0 or dt > self.max_gap_s):
+            dt = None
+        self.value = self.step(t, x, dt)
+        self.prev_t, self.prev_x = t, x
+        return self.value
+
+    def step(self, t, x, dt):
+        raise NotImplementedError
+
+
+class Integrate(Channel):
+    def __init__(self, name, scale=1.0, **kwargs):
+        super().__init__(name, **kwargs)
+        self.scale = scale
+        self.value = 0.0
+
+    def step(self, t, x, dt):
+        if dt is None:
+            return self.value
+        return self.value + (x + self.prev_x) * 0.5 * dt * self.scale
+
+
+class Derivative(Channel):
+    def __init__(self, name, scale=1.0, **kwargs):
+        super().__init__(name, **kwargs)
+        self.scale = scale
+
+    def step(self, t, x, dt):
+        if dt is None:
+            return self.value
+        return (x - self.prev_x) / dt * self.scale
+
+    def restart(self):
+        self.reset()
+        self.value = None
+
+
+class Ema(Channel):
+    def __init__(self, name, alpha=None, tau_s=None, **kwargs):
+        super().__init__(name, **kwargs)
+        if (alpha is None) == (tau_s is None):
+            raise ValueError(f"{name}: give exactly one of alpha or tau_s")
+        self.alpha = alpha
+        self.tau_s = tau_s
+
+    def step(self, t, x, dt):
+        if self.value is None or dt is None:
+            return x
+        # With tau_s the weight follows the real sample spacing
+        a = self.alpha if self.tau_s is None else 1.0 - math.exp(-dt / self.tau_s)
+        return self.value + a * (x - self.value)
+
+    def restart(self):
+        self.reset()
+        self.value = None
+
+
+class Median(Channel):
+    def __init__(self, name, window=5, **kwargs):
+        super().__init__(name, **kwargs)
+        self.window = max(1, int(window))
+        self.fifo = deque()
+        self.ordered = []
+
+    def step(self, t, x, dt):
+        self.fifo.append(x)
+        bisect.insort(self.ordered, x)
+        if len(self.fifo) > self.window:
+            old = self.fifo.popleft()
+            del self.ordered[bisect.bisect_left(self.ordered, old)]
+        n = len(self.ordered)
+        mid = n // 2
+        return self.ordered[mid] if n % 2 else (self.ordered[mid - 1] + self.ordered[mid]) * 0.5
+
+    def restart(self):
+        self.reset()
+        self.fifo.clear()
+        self.ordered.clear()
+        self.value = None
+
+
+EXPR_GLOBALS = {
+    "__builtins__": {},
+    "abs": abs, "min": min, "max": max, "round": round, "math": math,
+}
+
+
+class Expression(Channel):
+    def __init__(self, name, expr, **kwargs):
+        super().__init__(name, **kwargs)
+        self.expr = expr
+        self.code = compile(expr, f"<derived {name}>", "eval")
+        self.names = {}
+
+    def step(self, t, x, dt):
+        self.names.update(value=x, t=t, dt=dt or 0.0)
+        return float(eval(self.code, EXPR_GLOBALS, self.names))
+
+
+KINDS = {
+    "integrate": Integrate,
+    "derivative": Derivative,
+    "ema": Ema,
+    "median": Median,
+    "expr": Expression,
+}
+
+
+def make_channel(spec: dict) -> Channel:
+    spec = dict(spec)
+    kind = spec.pop("kind", None)
+    try:
+        cls = KINDS[kind]
+    except KeyError:
+        raise ValueError(f"Unknown derived channel kind {kind!r}") from None
+    try:
+        return cls(**spec)
+    except (TypeError, SyntaxError) as e:
+        raise ValueError(f"Derived channel {spec.get('name')!r}: {e}") from None
+
+
+class DerivedPipeline:
+    """One meter's derived channels, fed with every decoded sample."""
+
+    def __init__(self, specs):
+        self.channels = [make_channel(s) for s in specs]
+        names = {c.name for c in self.channels}
+        if len(names) != len(self.channels) or "value" in names:
+            raise ValueError("Derived channel names must be unique and not 'value'")
+        self.last_base = None
+
+    def update(self, t_mono_ns, value, unit) -> dict:
+        x, base = parse_reading(value, unit)
+        base_changed = base != self.last_base
+        self.last_base = base
+        t = t_mono_ns / 1e9
+        inputs = {"value": x}
+        out = {}
+        for ch in self.channels:
+            if base_changed:
+                ch.restart()
+            src = inputs.get(ch.source)
+            if src is None or (ch.unit is not None and ch.unit != base):
+                # Hold the last output; a skipped channel feeds nothing downstream
+                ch.reset()
+                inputs[ch.name] = None
+                out[ch.name] = ch.value
+                continue
+            if isinstance(ch, Expression):
+                ch.names.update(inputs)
+            try:
+                inputs[ch.name] = out[ch.name] = ch.update(t, src)
+            except Exception as e:
+                ch.errors += 1
+                (LOG.warning if ch.errors == 1 else LOG.debug)(
+                    "Derived channel %s failed: %s (outputs None for such samples)", ch.name, e)
+                ch.reset()
+                inputs[ch.name] = out[ch.name] = None
+        return out
@@ -0,0 +1,174 @@
+"""BLE DMM discovery
+
+Finds meters by advertised name or by the FFF0/FFF4 service UUIDs and
+remembers what it found, so scripts no longer need a hard-coded address.
+
+- One shared BleakScanner serves every lookup and the watcher
+- Resolved addresses and detected device types are cached on disk with a
+  TTL; startup and reconnects use the cache and never scan while it is
+  fresh
+- watch() reports meters seen for the first time, so a running bridge
+  can attach them without a restart
+
+Requires: bleak
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from bleak import BleakScanner
+
+LOG = logging.getLogger("ble_dmm_discovery")
+
+SERVICE_UUIDS = (
+    "0000fff0-0000-1000-8000-00805f9b34fb",
+    "0000fff4-0000-1000-8000-00805f9b34fb",
+)
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ble_dmm", "devices.json")
+CACHE_TTL_S = 7 * 24 * 3600
+
+
+def is_placeholder(address) -> bool:
+    return not address or address.upper().startswith("XX:")
+
+
+class DeviceCache:
+    def __init__(self, path=CACHE_PATH, ttl_s=CACHE_TTL_S):
+        self.path = path
+        self.ttl_s = ttl_s
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}  # address -> {"name", "device_type", "seen"}
+
+    def _fresh(self, entry):
+        return time.time() - entry.get("seen", 0) < self.ttl_s
+
+    def lookup(self, name):
+        best = None
+        for address, e in self.entries.items():
+            if e.get("name") == name and self._fresh(e):
+                if best is None or e["seen"] > self.entries[best]["seen"]:
+                    best = address
+        return best
+
+    def known(self):
+        return [a for a, e in self.entries.items() if self._fresh(e)]
+
+    def device_type(self, address):
+        e = self.entries.get(address)
+        return e.get("device_type") if e and self._fresh(e) else None
+
+    def remember(self, address, **fields):
+        e = self.entries.setdefault(address, {})
+        changed = any(e.get(k) != v for k, v in fields.items() if v is not None)
+        e.update((k, v) for k, v in fields.items() if v is not None)
+        # Refresh "seen" at most hourly so active meters don't rewrite the file
+        if changed or time.time() - e.get("seen", 0) > 3600:
+            e["seen"] = time.time()
+            self.save()
+
+    def forget(self, address):
+        if self.entries.pop(address, None) is not None:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+class Discovery:
+    def __init__(self, names=(), cache=None, service_uuids=SERVICE_UUIDS):
+        self.names = set(names)
+        self.service_uuids = set(service_uuids)
+        self.cache = cache or DeviceCache()
+        self.seen = set()       # addresses matched since start
+        self._watchers = []     # callbacks(address, name) for new meters
+        self._waiters = []      # (name, future, fallbacks) pending resolve() calls
+        self._scanner = None
+        self._users = 0
+
+    def matches(self, name, uuids) -> bool:
+        if name and name in self.names:
+            return True
+        return any(u.lower() in self.service_uuids for u in uuids or ())
+
+    def _on_advertisement(self, device, adv):
+        name = adv.local_name or device.name
+        if not self.matches(name, adv.service_uuids):
+            return
+        address = device.address
+        self.cache.remember(address, name=name)
+        for want, fut, fallbacks in list(self._waiters):
+            if fut.done():
+                continue
+            if want is None or want == name:
+                fut.set_result(address)
+            elif address not in fallbacks:
+                fallbacks.append(address)  # matched by service UUID only
+        if address not in self.seen:
+            self.seen.add(address)
+            LOG.info("Found meter %s (%s)", address, name)
+            for cb in self._watchers:
+                cb(address, name)
+
+    async def _acquire(self):
+        if self._scanner is None:
+            self._scanner = BleakScanner(detection_callback=self._on_advertisement)
+            try:
+                await self._scanner.start()
+            except Exception:
+                self._scanner = None
+                raise
+        self._users += 1
+
+    async def _release(self):
+        self._users -= 1
+        if self._users == 0 and self._scanner is not None:
+            scanner, self._scanner = self._scanner, None
+            await scanner.stop()
+
+    async def resolve(self, name=None, timeout=20.0, use_cache=True):
+        """Address of a meter called `name` (or any meter), cache first. If
+        no meter of that name shows up within timeout, the first one that
+        matched by service UUID is returned instead."""
+        if use_cache and name is not None:
+            address = self.cache.lookup(name)
+            if address:
+                return address
+        fut = asyncio.get_running_loop().create_future()
+        fallbacks = []
+        waiter = (name, fut, fallbacks)
+        self._waiters.append(waiter)
+        try:
+            await self._acquire()
+        except Exception:
+            self._waiters.remove(waiter)
+            raise
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            if fallbacks:
+                LOG.info("No meter named %r found, using %s (matched by service UUID)",
+                         name, fallbacks[0])
+                return fallbacks[0]
+            return None
+        finally:
+            self._waiters.remove(waiter)
+            await self._release()
+
+    async def watch(self, stop_event: asyncio.Event, on_new):
+        """Keep the shared scanner running and call on_new(address, name)."""
+        await self._acquire()
+        self._watchers.append(on_new)
+        try:
+            await stop_event.wait()
+        finally:
+            self._watchers.remove(on_new)
+            await self._release()
@@ -0,0 +1,336 @@
+"""Streaming distributions of DMM readings
+
+Quantiles and histograms of long measurement sessions (ripple, leakage
+current, ...) without keeping the samples:
+
+- KllSketch   mergeable quantile sketch (Karnin-Lang-Liberty); rank error
+              about 1.7/k with bounded memory whatever the sample count
+- LogHistogram  sparse histogram over fixed log-spaced bins (RESOLUTION
+              relative width), so histograms of any meter, unit or session
+              merge bin by bin
+- Summary     count/sum/min/max plus both of the above
+- DistributionStore  one Summary per (session, device, quantity, time
+              bucket) plus a per-session total that survives bucket
+              eviction; query() merges any selection of them
+
+Readings are normalized to base units (mV -> V); the quantity is the AC/DC
+marker followed by the base unit, e.g. "DC V" or "AC A", whatever order the
+meter's decoder lists the annunciators in, and is never merged across.
+
+Requires: nothing beyond the standard library
+"""
+import json
+import logging
+import math
+import os
+import random
+import time
+from datetime import datetime
+
+from derived import parse_reading
+
+LOG = logging.getLogger("ble_dmm_distribution")
+
+RESOLUTION = 0.01  # histogram bin width relative to the value
+
+
+def quantity(unit) -> str:
+    tokens = (unit or "").split()
+    _, base = parse_reading(None, unit)
+    return " ".join([t for t in ("AC", "DC") if t in tokens] + ([base] if base else []))
+
+
+class KllSketch:
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+        self.rng = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def _size(self):
+        return sum(len(c) for c in self.compactors)
+
+    def _max_size(self):
+        return sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def update(self, x):
+        self.compactors[0].append(x)
+        self.n += 1
+        if len(self.compactors[0]) >= self._capacity(0):
+            self._compress()
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for h, c in enumerate(self.compactors):
+                if len(c) >= self._capacity(h):
+                    if h + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    c.sort()
+                    # An odd item out stays at this level; of the rest every
+                    # other one moves up with twice the weight
+                    keep = [c.pop()] if len(c) % 2 else []
+                    self.compactors[h + 1].extend(c[self.rng.getrandbits(1)::2])
+                    c[:] = keep
+                    break
+
+    def merge(self, other: "KllSketch"):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for mine, theirs in zip(self.compactors, other.compactors):
+            mine.extend(theirs)
+        self.n += other.n
+        self._compress()
+
+    def quantiles(self, qs):
+        weighted = sorted((x, 1 << h) for h, c in enumerate(self.compactors) for x in c)
+        if not weighted:
+            return [None for _ in qs]
+        total = sum(w for _, w in weighted)
+        out = []
+        for q in qs:
+            target = q * total
+            seen = 0
+            for x, w in weighted:
+                seen += w
+                if seen >= target:
+                    break
+            out.append(x)
+        return out
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "compactors": [list(c) for c in self.compactors]}
+
+    @classmethod
+    def from_dict(cls, d):
+        sk = cls(d["k"])
+        sk.n = d["n"]
+        sk.compactors = [list(c) for c in d["compactors"]]
+        return sk
+
+
+class LogHistogram:
+    def __init__(self):
+        self.bins = {}  # signed bin index -> count; 0 holds exact zeros
+
+    @staticmethod
+    def index(x):
+        if x == 0:
+            return 0
+        i = int(math.floor(math.log(abs(x)) / math.log1p(RESOLUTION))) + 1_000_000
+        return i if x > 0 else -i
+
+    @staticmethod
+    def bounds(i):
+        if i == 0:
+            return 0.0, 0.0
+        lo = (1 + RESOLUTION) ** (abs(i) - 1_000_000)
+        hi = lo * (1 + RESOLUTION)
+        return (lo, hi) if i > 0 else (-hi, -lo)
+
+    def update(self, x):
+        i = self.index(x)
+        self.bins[i] = self.bins.get(i, 0) + 1
+
+    def merge(self, other: "LogHistogram"):
+        for i, n in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + n
+
+    def rebin(self, lo, hi, bins):
+        """Counts in `bins` equal-width bins over [lo, hi] (to RESOLUTION)."""
+        counts = [0] * bins
+        width = (hi - lo) / bins or 1.0
+        for i, n in self.bins.items():
+            b_lo, b_hi = self.bounds(i)
+            mid = (b_lo + b_hi) / 2 if i else 0.0
+            j = min(bins - 1, max(0, int((min(max(mid, lo), hi) - lo) / width)))
+            counts[j] += n
+        return [{"lo": lo + j * width, "hi": lo + (j + 1) * width, "count": c}
+                for j, c in enumerate(counts)]
+
+    def to_dict(self):
+        return {str(i): n for i, n in self.bins.items()}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls()
+        h.bins = {int(i): n for i, n in d.items()}
+        return h
+
+
+class Summary:
+    def __init__(self, k=200):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = KllSketch(k)
+        self.histogram = LogHistogram()
+
+    def update(self, x):
+        self.count += 1
+        self.sum += x
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        self.sketch.update(x)
+        self.histogram.update(x)
+
+    def merge(self, other: "Summary"):
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        self.histogram.merge(other.histogram)
+
+    def report(self, qs=(0.5, 0.95, 0.99), bins=20):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count,
+            "quantiles": dict(zip((str(q) for q in qs), self.sketch.quantiles(qs))),
+            "histogram": self.histogram.rebin(self.min, self.max, bins),
+        }
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+                "sketch": self.sketch.to_dict(), "histogram": self.histogram.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d):
+        s = cls()
+        s.count, s.sum, s.min, s.max = d["count"], d["sum"], d["min"], d["max"]
+        s.sketch = KllSketch.from_dict(d["sketch"])
+        s.histogram = LogHistogram.from_dict(d["histogram"])
+        return s
+
+
+def session_name(t=None) -> str:
+    return datetime.fromtimestamp(time.time() if t is None else t).strftime("%Y%m%d-%H%M%S")
+
+
+class DistributionStore:
+    def __init__(self, bucket_s=300, max_buckets=5000, k=200, path=None):
+        self.bucket_s = int(bucket_s)
+        self.max_buckets = max_buckets
+        self.k = k
+        self.path = path
+        self.session = session_name()
+        self.buckets = {}  # (session, device, quantity, bucket start s) -> Summary
+        self.totals = {}   # (session, device, quantity) -> Summary
+        self.evicted = 0
+        if path is not None:
+            self.load()
+
+    def new_session(self, name=None):
+        self.session = name or session_name()
+        return self.session
+
+    def add(self, device, t_wall_ns, value, unit):
+        x, _ = parse_reading(value, unit)
+        if x is None:
+            return
+        q = quantity(unit)
+        start = t_wall_ns // 1_000_000_000 // self.bucket_s * self.bucket_s
+        key = (self.session, device, q, start)
+        s = self.buckets.get(key)
+        if s is None:
+            s = self.buckets[key] = Summary(self.k)
+            if len(self.buckets) > self.max_buckets:
+                self._evict()
+        s.update(x)
+        total = self.totals.get(key[:3])
+        if total is None:
+            total = self.totals[key[:3]] = Summary(self.k)
+        total.update(x)
+
+    def _evict(self):
+        # Oldest buckets go first; their samples stay in the session totals
+        for key in sorted(self.buckets, key=lambda k: k[3])[:len(self.buckets) - self.max_buckets]:
+            del self.buckets[key]
+            self.evicted += 1
+
+    def sessions(self):
+        return sorted({key[0] for key in self.totals})
+
+    def query(self, devices=None, quantities=None, sessions=None, since_s=None, until_s=None,
+              every_s=None):
+        """Merged summaries: {quantity: Summary}, or with every_s
+        {quantity: {interval start s: Summary}}."""
+        def wanted(session, device, q):
+            return (sessions is None or session in sessions) and \
+                (devices is None or device in devices) and \
+                (quantities is None or q in quantities)
+
+        out = {}
+        if since_s is None and until_s is None and every_s is None:
+            for (session, device, q), s in self.totals.items():
+                if wanted(session, device, q):
+                    out.setdefault(q, Summary(self.k)).merge(s)
+            return out
+        for (session, device, q, start), s in self.buckets.items():
+            if not wanted(session, device, q):
+                continue
+            if (since_s is not None and start + self.bucket_s <= since_s) or \
+                    (until_s is not None and start > until_s):
+                continue
+            if every_s is None:
+                out.setdefault(q, Summary(self.k)).merge(s)
+            else:
+                interval = start // every_s * every_s
+                out.setdefault(q, {}).setdefault(interval, Summary(self.k)).merge(s)
+        return out
+
+    def snapshot(self) -> dict:
+        """Copy of everything, taken on the thread that calls add()."""
+        return {
+            "bucket_s": self.bucket_s,
+            "buckets": [[*key, s.to_dict()] for key, s in self.buckets.items()],
+            "totals": [[*key, s.to_dict()] for key, s in self.totals.items()],
+        }
+
+    def write(self, data: dict):
+        """Write a snapshot() to path; safe to run in an executor."""
+        if self.path is None:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def save(self):
+        self.write(self.snapshot())
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            LOG.warning("Could not load %s: %s", self.path, e)
+            return
+        # Keys are rebuilt with quantity(), so files written with an older
+        # naming merge into the current one
+        if data.get("bucket_s") != self.bucket_s:
+            LOG.warning("%s uses %ss buckets, keeping only its session totals",
+                        self.path, data.get("bucket_s"))
+        else:
+            for session, device, q, start, s in data["buckets"]:
+                self._load_into(self.buckets, (session, device, quantity(q), start), s)
+        for session, device, q, s in data["totals"]:
+            self._load_into(self.totals, (session, device, quantity(q)), s)
+        LOG.info("Loaded distributions of %d sessions from %s", len(self.sessions()), self.path)
+
+    def _load_into(self, summaries, key, d):
+        s = Summary.from_dict(d)
+        if key in summaries:
+            summaries[key].merge(s)
+        else:
+            summaries[key] = s
@@ -0,0 +1,126 @@
+"""Pooled poller for ESP32 firmware bridges
+
+Polls GET /api/latest on any number of wifi_multimeter.ino devices through
+one shared aiohttp session, so each ESP32 sees exactly one client no matter
+how many browsers watch the web bridge.
+
+- Keep-alive connections from a single pool, at most per_host concurrent
+  requests per ESP32 (its WebServer handles one request at a time)
+- Adaptive interval: polls at min_interval while the reading changes,
+  backs off towards max_interval while it is steady, and backs off
+  exponentially while a device is unreachable
+- Per-request timeout, so one dead device never stalls the others
+
+Samples are handed to on_sample(address, **fields) in the same shape the
+BLE reader produces; on_status(address, connected) reports transitions.
+
+Requires: aiohttp
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from clock import CaptureClock
+
+LOG = logging.getLogger("ble_dmm_esp32")
+
+
+def endpoint_address(url: str) -> str:
+    u = urlsplit(url if "://" in url else "http://" + url)
+    return f"esp32:{u.netloc}"
+
+
+class Esp32Poller:
+    def __init__(self, endpoints, on_sample, on_status=None, clock=None,
+                 min_interval=0.333, max_interval=5.0, backoff=1.5,
+                 timeout=2.0, per_host=1, pool_size=100):
+        self.endpoints = [e.rstrip("/") if "://" in e else "http://" + e.rstrip("/") for e in endpoints]
+        self.on_sample = on_sample
+        self.on_status = on_status
+        self.clock = clock or CaptureClock()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.per_host = per_host
+        self.pool_size = pool_size
+        self.stats = {}  # address -> counters
+
+    async def run(self, stop_event: asyncio.Event):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*(self._poll(session, url, stop_event) for url in self.endpoints))
+
+    def _set_status(self, address, connected, st):
+        if st["connected"] != connected:
+            st["connected"] = connected
+            LOG.info("%s %s", address, "reachable" if connected else "unreachable")
+            if self.on_status is not None:
+                self.on_status(address, connected)
+
+    async def _poll(self, session, base, stop_event):
+        address = endpoint_address(base)
+        url = base + "/api/latest"
+        st = self.stats[address] = {
+            "connected": None, "polls": 0, "changes": 0, "errors": 0, "interval": self.min_interval,
+        }
+        failing = False
+        last = None
+        interval = self.min_interval
+        while not stop_event.is_set():
+            started = self.clock.capture()
+            try:
+                async with session.get(url) as resp:
+                    resp.raise_for_status()
+                    body = await resp.read()
+                t_mono = self.clock.capture()
+                reading = json.loads(body)
+                if not isinstance(reading, dict):
+                    raise ValueError("response is not a JSON object")
+                st["polls"] += 1
+                self._set_status(address, True, st)
+
+                key = (reading.get("value"), reading.get("unit"), reading.get("functions"))
+                if key != last:
+                    st["changes"] += 1
+                    interval = self.min_interval
+                    last = key
+                else:
+                    interval = min(interval * self.backoff, self.max_interval)
+
+                await self.on_sample(
+                    address,
+                    t_mono_ns=t_mono,
+                    t_wall_ns=self.clock.to_wall_ns(t_mono),
+                    value=reading.get("value"),
+                    unit=(reading.get("unit") or "").strip(),
+                    functions=(reading.get("functions") or "").strip(),
+                    connected=True,
+                )
+                failing = False
+            except asyncio.CancelledError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                st["errors"] += 1
+                if st["connected"] is not False:
+                    LOG.warning("%s poll failed: %s", address, e)
+                self._set_status(address, False, st)
+                interval = min(max(interval, self.min_interval) * 2, self.max_interval)
+            except Exception:
+                # e.g. on_sample failing; never let one poll stop this device's loop
+                st["errors"] += 1
+                if not failing:
+                    LOG.exception("%s poll failed", address)
+                    failing = True
+                interval = min(max(interval, self.min_interval) * 2, self.max_interval)
+
+            st["interval"] = interval
+            elapsed = (self.clock.capture() - started) / 1e9
+            try:
+                await asyncio.wait_for(stop_event.wait(), max(0.0, interval - elapsed))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,100 @@
+"""Sample history for the BLE DMM bridge
+
+- History   bounded in-memory ring of recent samples per meter (/api/history)
+- Recorder  persists every sample as JSON lines in time-aligned segment
+            files (one file per RECORD_SEGMENT_S), closed on rotation;
+            closed segments are handed to on_close (e.g. archive.py)
+
+Requires: nothing beyond the standard library
+"""
+import bisect
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+LOG = logging.getLogger("ble_dmm_history")
+
+RECORD_FIELDS = ("t_wall_ns", "t_mono_ns", "value", "unit", "functions", "derived")
+
+
+def sample_record(payload: dict) -> dict:
+    record = {"device": payload["target_addr"]}
+    for k in RECORD_FIELDS:
+        record[k] = payload.get(k)
+    return record
+
+
+class History:
+    def __init__(self, maxlen=20000):
+        self.maxlen = maxlen
+        self.samples = {}  # device -> deque of records, oldest first
+
+    def append(self, record: dict):
+        q = self.samples.get(record["device"])
+        if q is None:
+            q = self.samples[record["device"]] = deque(maxlen=self.maxlen)
+        q.append(record)
+
+    def oldest_ns(self, device):
+        q = self.samples.get(device)
+        return q[0]["t_wall_ns"] if q else None
+
+    def query(self, device, since_ns=None, until_ns=None, limit=None):
+        q = self.samples.get(device)
+        if not q:
+            return []
+        key = lambda r: r["t_wall_ns"]
+        lo = 0 if since_ns is None else bisect.bisect_left(q, since_ns, key=key)
+        hi = len(q) if until_ns is None else bisect.bisect_right(q, until_ns, key=key)
+        if limit is not None:
+            lo = max(lo, hi - limit)  # newest `limit` samples of the range
+        return [q[i] for i in range(lo, hi)]
+
+
+def segment_name(start_s: int) -> str:
+    return "dmm-" + datetime.fromtimestamp(start_s).strftime("%Y%m%d-%H%M%S") + ".jsonl"
+
+
+class Recorder:
+    def __init__(self, directory, segment_s=3600, flush_s=1.0):
+        self.directory = directory
+        self.segment_s = int(segment_s)
+        self.flush_s = flush_s
+        self.file = None
+        self.segment_start = None
+        self.last_flush = 0.0
+        self.on_close = []  # callbacks(path) for segments closed by rotation
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: dict):
+        start = record["t_wall_ns"] // 1_000_000_000 // self.segment_s * self.segment_s
+        # Never rotate backwards: a late sample (interleaved sources, a clock
+        # step) goes into the current segment, which is re-sorted on compaction
+        if self.segment_start is None or start > self.segment_start:
+            self._rotate(start)
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_s:
+            self.file.flush()
+            self.last_flush = now
+
+    def _rotate(self, start):
+        closed = self.file.name if self.file is not None else None
+        self.close()
+        if closed is not None:
+            for cb in self.on_close:
+                cb(closed)
+        path = os.path.join(self.directory, segment_name(start))
+        self.file = open(path, "a", encoding="utf-8")
+        self.segment_start = start
+        LOG.info("Recording to %s", path)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.segment_start = None
@@ -0,0 +1,182 @@
+"""Load generator for the BLE DMM web bridge
+
+Opens many SSE subscribers (/stream) and HTTP pollers (/api/latest) against
+a running bridge and reports:
+  - end-to-end latency percentiles (sample capture time -> client receipt)
+  - delivered events and requests per second, errors
+  - server CPU and peak RSS (Linux, when --pid is given)
+
+Pair it with SIMULATED_DEVICES in "BLE with webui.py" so no physical meter
+is needed, e.g.
+  python loadtest.py --sse 2000 --pollers 200 --duration 30 --pid 12345
+
+Latency uses the payload's t_wall_ns, so run the generator on the same
+host as the bridge (or on hosts with synchronized clocks).
+Large client counts may need a higher open-file limit (ulimit -n).
+
+Requires: aiohttp
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import aiohttp
+
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.latencies_ms = []
+        self.events = 0
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+
+    def sample(self, body: bytes):
+        self.events += 1
+        try:
+            t_wall_ns = json.loads(body).get("t_wall_ns")
+        except ValueError:
+            self.errors += 1
+            return
+        if t_wall_ns:
+            self.latencies_ms.append((time.time_ns() - t_wall_ns) / 1e6)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    i = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+# ======= Server process metrics (Linux /proc) =======
+
+def proc_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of the full line
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def proc_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+async def watch_server(pid, stop, out):
+    out["rss_peak_mb"] = proc_rss_mb(pid)
+    while not stop.is_set():
+        out["rss_peak_mb"] = max(out["rss_peak_mb"], proc_rss_mb(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), 1.0)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ======= Clients =======
+
+async def sse_client(session, url, stats, stop):
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=None)) as resp:
+            async for line in resp.content:
+                if stop.is_set():
+                    break
+                if line.startswith(b"data: "):
+                    stats.sample(line[6:])
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        stats.errors += 1
+
+
+async def poll_client(session, url, stats, stop, interval, wait):
+    etag = None
+    params = {"wait": str(wait)} if wait else {}
+    while not stop.is_set():
+        headers = {"If-None-Match": etag} if etag else {}
+        try:
+            async with session.get(url, params=params, headers=headers) as resp:
+                stats.requests += 1
+                if resp.status == 304:
+                    stats.not_modified += 1
+                elif resp.status == 200:
+                    etag = resp.headers.get("ETag")
+                    stats.sample(await resp.read())
+                else:
+                    stats.errors += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            stats.errors += 1
+        if not wait:
+            await asyncio.sleep(interval)
+
+
+async def run(args):
+    base = args.url.rstrip("/")
+    query = f"?device={args.device}" if args.device else ""
+    stats = Stats()
+    stop = asyncio.Event()
+    server = {}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = []
+        for i in range(args.sse):
+            tasks.append(asyncio.create_task(sse_client(session, base + "/stream" + query, stats, stop)))
+            if args.ramp and i % 100 == 99:
+                await asyncio.sleep(args.ramp)
+        for _ in range(args.pollers):
+            tasks.append(asyncio.create_task(poll_client(
+                session, base + "/api/latest" + query, stats, stop, args.interval, args.wait)))
+
+        # Measure only once every client is connected
+        await asyncio.sleep(1.0)
+        stats.reset()
+        if args.pid:
+            cpu0 = proc_cpu_seconds(args.pid)
+            tasks.append(asyncio.create_task(watch_server(args.pid, stop, server)))
+        t0 = time.monotonic()
+        await asyncio.sleep(args.duration)
+        elapsed = time.monotonic() - t0
+        if args.pid:
+            server["cpu_pct"] = (proc_cpu_seconds(args.pid) - cpu0) / elapsed * 100
+        stop.set()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    lat = sorted(stats.latencies_ms)
+    print(f"clients: {args.sse} SSE + {args.pollers} pollers, {elapsed:.1f}s")
+    print(f"events:  {stats.events} ({stats.events / elapsed:.0f}/s)")
+    print(f"polls:   {stats.requests} ({stats.requests / elapsed:.0f}/s, {stats.not_modified} not modified)")
+    print(f"errors:  {stats.errors}")
+    print("latency: p50 {:.1f} ms  p90 {:.1f} ms  p99 {:.1f} ms  max {:.1f} ms".format(
+        percentile(lat, 50), percentile(lat, 90), percentile(lat, 99), lat[-1] if lat else float("nan")))
+    if server:
+        print(f"server:  {server['cpu_pct']:.0f}% CPU, peak RSS {server['rss_peak_mb']:.0f} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--device", help="follow a single meter (address)")
+    ap.add_argument("--sse", type=int, default=100, help="number of SSE subscribers")
+    ap.add_argument("--pollers", type=int, default=0, help="number of /api/latest pollers")
+    ap.add_argument("--interval", type=float, default=0.333, help="poll interval in seconds")
+    ap.add_argument("--wait", type=float, default=0.0, help="long-poll wait (0 = plain polling)")
+    ap.add_argument("--duration", type=float, default=10.0, help="measurement window in seconds")
+    ap.add_argument("--ramp", type=float, default=0.05, help="pause per 100 new SSE clients")
+    ap.add_argument("--pid", type=int, help="bridge process id for CPU/RSS (Linux)")
+    args = ap.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
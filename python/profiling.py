@@ -0,0 +1,190 @@
+"""On-demand diagnostics for the running BLE DMM bridge
+
+Nothing here runs until an admin endpoint asks for it:
+
+- SamplingProfiler  statistical profiler for a fixed time; the result is a
+                    collapsed-stack file for flamegraph.pl or speedscope.
+                    "cpu" mode samples the event loop thread on SIGPROF, so
+                    samples follow CPU time; "wall" mode samples every
+                    thread's stack from sys._current_frames() in a
+                    background thread (also where SIGPROF is unavailable)
+- MemoryTracer      tracemalloc start/stop, top allocation sites and the
+                    diff against the previous snapshot (leak hunting)
+- TaskWatch         asyncio task dump with the full await chain of every
+                    task and how long it has been parked at the same spot
+
+Requires: nothing beyond the standard library
+"""
+import asyncio
+import logging
+import math
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+
+LOG = logging.getLogger("ble_dmm_profiling")
+
+# Leaf frames of a thread that is just waiting for I/O or a lock
+IDLE_LEAVES = {"select", "wait", "_wait_for_tstate_lock", "_worker"}
+
+
+def _frame_label(code, lineno=None):
+    where = f"{os.path.basename(code.co_filename)}:{lineno or code.co_firstlineno}"
+    return f"{code.co_name} ({where})"
+
+
+class SamplingProfiler:
+    def __init__(self, hz=100.0, include_idle=False, mode="cpu"):
+        if mode not in ("cpu", "wall"):
+            raise ValueError(f"Unknown profiler mode {mode!r}")
+        if not hasattr(signal, "setitimer"):
+            mode = "wall"
+        if not math.isfinite(hz):
+            raise ValueError(f"hz must be finite, not {hz!r}")
+        self.mode = mode
+        self.interval = 1.0 / max(hz, 1.0)
+        self.include_idle = include_idle
+        self.counts = Counter()
+        self.samples = 0
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling; in "cpu" mode this must be called from the main thread."""
+        self.started = time.monotonic()
+        if self.mode == "cpu":
+            self._prev_handler = signal.signal(signal.SIGPROF, self._on_sigprof)
+            try:
+                signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            except Exception:
+                signal.signal(signal.SIGPROF, self._prev_handler)
+                raise
+        else:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ble-dmm-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self.mode == "cpu":
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._prev_handler)
+        else:
+            self._stop.set()
+            self._thread.join()
+        LOG.info("Profiled %.1fs, %d samples", time.monotonic() - self.started, self.samples)
+
+    def _record(self, thread_name, frame):
+        if not self.include_idle and frame.f_code.co_name in IDLE_LEAVES:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        stack.append(thread_name)
+        self.counts[";".join(reversed(stack))] += 1
+
+    def _on_sigprof(self, _signum, frame):
+        self.samples += 1
+        if frame is not None:
+            self._record(threading.current_thread().name, frame)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self._record(names.get(ident, str(ident)), frame)
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.counts.most_common())
+
+
+class MemoryTracer:
+    def __init__(self):
+        self.baseline = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            LOG.info("tracemalloc started (%d frames)", frames)
+
+    def stop(self):
+        self.baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            LOG.info("tracemalloc stopped")
+
+    def snapshot(self, limit=25, key="lineno") -> dict:
+        """Top allocation sites, and the growth since the previous snapshot."""
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        where = lambda stat: [f"{f.filename}:{f.lineno}" for f in stat.traceback]
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [{"where": where(s), "size": s.size, "count": s.count}
+                    for s in snap.statistics(key)[:limit]],
+            "diff": None,
+        }
+        if self.baseline is not None:
+            report["diff"] = [
+                {"where": where(s), "size": s.size, "size_diff": s.size_diff,
+                 "count": s.count, "count_diff": s.count_diff}
+                for s in snap.compare_to(self.baseline, key)[:limit]
+            ]
+        self.baseline = snap
+        return report
+
+
+def await_chain(coro):
+    """Frames from the task's coroutine down to whatever it is awaiting."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) \
+            or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(_frame_label(frame.f_code, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) \
+            or getattr(coro, "ag_await", None)
+    return frames
+
+
+class TaskWatch:
+    """Dumps asyncio tasks; waits are measured from the first dump that saw
+    a task parked at its current spot, so they are lower bounds."""
+
+    def __init__(self):
+        self._parked = weakref.WeakKeyDictionary()  # task -> (stack, since)
+
+    def dump(self) -> list:
+        now = time.monotonic()
+        tasks = []
+        for task in asyncio.all_tasks():
+            stack = await_chain(task.get_coro())
+            parked = self._parked.get(task)
+            if parked is None or parked[0] != stack:
+                parked = self._parked[task] = (stack, now)
+            tasks.append({
+                "name": task.get_name(),
+                "coro": getattr(task.get_coro(), "__qualname__", repr(task.get_coro())),
+                "stack": stack,
+                "waiting_s": round(now - parked[1], 3),
+            })
+        tasks.sort(key=lambda t: t["waiting_s"], reverse=True)
+        return tasks
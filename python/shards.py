@@ -0,0 +1,213 @@
+"""Sharded acquisition for the BLE DMM bridge
+
+Runs the meter readers in worker processes (one per Bluetooth adapter or
+device group) so decoding and BLE I/O no longer compete with HTTP and the
+SSE fan-out for a single core.
+
+- SampleRing  single-writer ring of fixed-size sample records in
+              multiprocessing.shared_memory; the worker appends, the web
+              process unpacks records straight out of the shared buffer.
+              No locks: every slot carries a sequence stamp (seqlock) and
+              a reader that was lapped by the writer counts the loss
+              instead of blocking it
+- Supervisor  starts the worker processes and restarts crashed ones with
+              backoff; rings outlive their workers, so a restarted worker
+              continues where the previous one stopped. on_exit hears of
+              every crash, e.g. to mark the shard's meters disconnected
+
+Requires: nothing beyond the standard library
+"""
+import asyncio
+import logging
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+
+LOG = logging.getLogger("ble_dmm_shards")
+
+SAMPLE, CONNECTED, DEVICE_TYPE, FRAME = 0, 1, 2, 3
+
+# capacity, head (records written so far)
+HEADER = struct.Struct("<Q Q")
+HEAD_OFFSET = 8
+STAMP = struct.Struct("<Q")
+ADDRESS_BYTES = 24  # fits MACs and "sim:"/"esp32:" ids, not 36-char UUIDs
+# kind, connected, t_mono_ns, t_wall_ns, address, value, unit, functions;
+# FRAME records carry the bit count in value and the bits in functions
+RECORD = struct.Struct(f"<B ? 6x q q {ADDRESS_BYTES}s 16s 16s 64s")
+SLOT_SIZE = STAMP.size + RECORD.size
+
+
+def _text(b: bytes):
+    return b.rstrip(b"\0").decode("utf-8", "ignore")
+
+
+class SampleRing:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.buf = shm.buf
+        self.owner = owner
+        self.capacity, self.cursor = HEADER.unpack_from(self.buf, 0)  # readers start at the head
+        self.lost = 0
+
+    @classmethod
+    def create(cls, slots=4096):
+        shm = shared_memory.SharedMemory(create=True, size=HEADER.size + slots * SLOT_SIZE)
+        HEADER.pack_into(shm.buf, 0, slots, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        # Workers are spawned by the Supervisor and share the creator's
+        # resource tracker, which unlinks the segment if everything dies
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # ----- writer (one process per ring) -----
+
+    def _append(self, kind, address, connected=False, t_mono_ns=0, t_wall_ns=0,
+                value="", unit="", functions=""):
+        n = STAMP.unpack_from(self.buf, HEAD_OFFSET)[0]
+        off = HEADER.size + (n % self.capacity) * SLOT_SIZE
+        STAMP.pack_into(self.buf, off, 2 * n + 1)  # odd: slot being written
+        RECORD.pack_into(
+            self.buf, off + STAMP.size, kind, bool(connected), t_mono_ns or 0, t_wall_ns or 0,
+            address.encode("utf-8")[:ADDRESS_BYTES], (value or "").encode("utf-8")[:16],
+            (unit or "").encode("utf-8")[:16],
+            functions if isinstance(functions, bytes) else (functions or "").encode("utf-8")[:64],
+        )
+        STAMP.pack_into(self.buf, off, 2 * n + 2)
+        STAMP.pack_into(self.buf, HEAD_OFFSET, n + 1)
+
+    def write_sample(self, address, t_mono_ns, t_wall_ns, value, unit, functions, connected=True):
+        self._append(SAMPLE, address, connected, t_mono_ns, t_wall_ns, value, unit, functions)
+
+    def write_status(self, address, **fields):
+        if "connected" in fields:
+            self._append(CONNECTED, address, connected=fields["connected"])
+        if "device_type" in fields:
+            self._append(DEVICE_TYPE, address, value=fields["device_type"])
+
+    def write_frame(self, address, t_mono_ns, bits: int, nbits: int):
+        """Prepared frame bits for the debug view (up to 512 bits)."""
+        self._append(FRAME, address, t_mono_ns=t_mono_ns, value=str(nbits),
+                     functions=bits.to_bytes((nbits + 7) // 8, "big")[:64])
+
+    # ----- reader -----
+
+    def read(self, max_records=1024):
+        """Yield (kind, address, fields) for records written since the last call."""
+        head = STAMP.unpack_from(self.buf, HEAD_OFFSET)[0]
+        if head - self.cursor > self.capacity:
+            self.lost += head - self.capacity - self.cursor
+            self.cursor = head - self.capacity
+        end = min(head, self.cursor + max_records)
+        while self.cursor < end:
+            n = self.cursor
+            self.cursor += 1
+            off = HEADER.size + (n % self.capacity) * SLOT_SIZE
+            stamp = STAMP.unpack_from(self.buf, off)[0]
+            if stamp != 2 * n + 2:
+                self.lost += 1  # overwritten by a newer lap
+                continue
+            kind, connected, t_mono, t_wall, address, value, unit, functions = \
+                RECORD.unpack_from(self.buf, off + STAMP.size)
+            if STAMP.unpack_from(self.buf, off)[0] != stamp:
+                self.lost += 1  # overwritten while we were reading it
+                continue
+            address = _text(address)
+            if kind == SAMPLE:
+                yield kind, address, {
+                    "t_mono_ns": t_mono, "t_wall_ns": t_wall, "value": _text(value) or None,
+                    "unit": _text(unit), "functions": _text(functions), "connected": connected,
+                }
+            elif kind == CONNECTED:
+                yield kind, address, {"connected": connected}
+            elif kind == DEVICE_TYPE:
+                yield kind, address, {"device_type": _text(value) or None}
+            elif kind == FRAME:
+                nbits = int(_text(value))
+                bits = int.from_bytes(functions[:(nbits + 7) // 8], "big")
+                yield kind, address, {"t_mono_ns": t_mono, "bits": bits, "nbits": nbits}
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Supervisor:
+    """Keeps one process per shard running, restarting crashed ones."""
+
+    def __init__(self, target, min_delay=1.0, max_delay=30.0, stable_s=60.0, on_exit=None):
+        self.target = target
+        self.on_exit = on_exit  # callback(name, exitcode) when a shard process dies
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stable_s = stable_s
+        self.ctx = multiprocessing.get_context("spawn")
+        self.shards = {}  # name -> {"args", "process", "started", "delay", "restarts"}
+
+    def add(self, name, *args):
+        self.shards[name] = {"args": args, "process": None, "started": 0.0,
+                             "delay": self.min_delay, "restarts": 0, "due": 0.0}
+
+    def _start(self, name, shard):
+        p = self.ctx.Process(target=self.target, args=shard["args"], name=name, daemon=True)
+        p.start()
+        shard["process"] = p
+        shard["started"] = time.monotonic()
+        LOG.info("Started %s (pid %d)", name, p.pid)
+
+    async def run(self, stop_event: asyncio.Event, check_s=0.5):
+        try:
+            for name, shard in self.shards.items():
+                self._start(name, shard)
+            while not stop_event.is_set():
+                now = time.monotonic()
+                for name, shard in self.shards.items():
+                    p = shard["process"]
+                    if p is not None and p.exitcode is None:
+                        continue
+                    if p is not None:
+                        # Crashed: back off exponentially unless it had been up for a while
+                        ran = now - shard["started"]
+                        if ran >= self.stable_s:
+                            shard["delay"] = self.min_delay
+                        shard["due"] = now + shard["delay"]
+                        shard["process"] = None
+                        LOG.warning("%s exited with code %s after %.1fs, restarting in %.1fs",
+                                    name, p.exitcode, ran, shard["delay"])
+                        shard["delay"] = min(shard["delay"] * 2, self.max_delay)
+                        if self.on_exit is not None:
+                            self.on_exit(name, p.exitcode)
+                    elif now >= shard["due"]:
+                        shard["restarts"] += 1
+                        self._start(name, shard)
+                try:
+                    await asyncio.wait_for(stop_event.wait(), check_s)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.stop()
+
+    async def stop(self, timeout=5.0):
+        procs = [s["process"] for s in self.shards.values() if s["process"] is not None]
+        for p in procs:
+            if p.exitcode is None:
+                p.terminate()
+        deadline = time.monotonic() + timeout
+        while any(p.exitcode is None for p in procs) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for p in procs:
+            if p.exitcode is None:
+                LOG.warning("%s did not stop, killing it", p.name)
+                p.kill()
+            p.join(0.1)
+        for s in self.shards.values():
+            s["process"] = None
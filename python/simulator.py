@@ -0,0 +1,204 @@
+"""Synthetic BLE DMM meters
+
+Produces encoded frames exactly as a real meter sends them over BLE: the
+display digits, decimal points and annunciators are laid out in the
+prepared bit string that pre_process() expects, the type code for
+type_detecter sits in bits 16..23, and every byte is bit-reversed and
+XORed with the vendor key.
+
+- SimulatedMeter   one virtual device with a configurable waveform
+- SimulatedClient  drop-in for BleakClient, so the web bridge can run a
+                   fleet of virtual meters (SIMULATED_DEVICES)
+
+Run directly to benchmark frame generation for N devices:
+  python simulator.py --devices 50 --hz 10 --seconds 5
+
+Requires: nothing beyond the standard library
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+
+XOR_KEY = [0x41,0x21,0x73,0x55,0xa2,0xc1,0x32,0x71,0x66,0xaa,0x3b,0xd0,0xe2,0xa8,0x33,0x14,0x20,0x21,0xaa,0xbb]
+FRAME_LEN = 11  # bytes; bits 0..87 carry header, type, digits and icons
+
+TYPE_CODES = {  # inverse of type_detecter.type_dict
+    '1': '11000000',
+    '2': '01000000',
+    '3': '10000000',
+    '4': '00100000',
+}
+
+# 7-segment patterns in the bit order BaseDecoder.digit() reads them
+DIGIT_PATTERNS = {
+    '0':'1110111','1':'0010010','2':'1011101','3':'1011011','4':'0111010',
+    '5':'1101011','6':'1101111','7':'1010010','8':'1111111','9':'1111011',
+}
+# Segment offset inside an 8-bit digit field for each pattern character:
+# BaseDecoder.digit() builds seg[3]+seg[2]+seg[7]+seg[6]+seg[1]+seg[5]+seg[4]
+SEGMENT_ORDER = (3, 2, 7, 6, 1, 5, 4)
+DIGIT_FIELDS = (28, 36, 44, 52)  # start bit of each of the 4 digits
+
+# Prepared-bit indices of the annunciators for each measurement mode
+MODE_BITS = {
+    '1': {  # decoder_1 layout (types 1, 3 and 4)
+        "V DC": (76, 78, 80), "mV DC": (77, 76, 78, 80), "V AC": (76, 67, 80),
+        "A DC": (79, 78, 80), "mA DC": (83, 79, 78, 80), "μA DC": (82, 79, 78, 80),
+        "Ω": (73, 80), "kΩ": (74, 73, 80), "MΩ": (75, 73, 80),
+        "Hz": (72, 80), "°C": (62,),
+    },
+    '2': {  # decoder_2 layout
+        "V DC": (65, 66), "mV DC": (74, 65, 66), "V AC": (65, 67),
+        "A DC": (70, 66), "mA DC": (74, 70, 66), "μA DC": (71, 70, 66),
+        "Ω": (72,), "kΩ": (73, 72), "MΩ": (75, 72),
+        "Hz": (77,), "°C": (79,),
+    },
+}
+MODE_BITS['3'] = MODE_BITS['4'] = MODE_BITS['1']
+
+
+def display_digits(value: float):
+    """Fit value into the 4-digit display: (negative, digits, decimal index)."""
+    negative = value < 0
+    mag = abs(value)
+    for decimals in (3, 2, 1, 0):
+        text = f"{mag:.{decimals}f}"
+        digits = text.replace('.', '')
+        if len(digits) <= 4:
+            return negative, digits.rjust(4, '0')[-4:], (4 - decimals if decimals else None)
+    return negative, '9999', None  # overload: clamp like the meter's "OL" range
+
+
+def encode_bits(bits) -> bytes:
+    """Inverse of pre_process(): prepared bits -> raw BLE frame."""
+    out = bytearray(len(bits) // 8)
+    for b in range(len(out)):
+        byte = 0
+        for j in range(8):
+            if bits[8 * b + j]:
+                byte |= 1 << j
+        out[b] = byte ^ XOR_KEY[b]
+    return bytes(out)
+
+
+def encode_frame(dev_type: str, value: float, mode: str = "V DC", hold=False) -> bytes:
+    bits = [0] * (FRAME_LEN * 8)
+    # Plain header as seen on the meter's UART (0x5A 0xA5), LSB first
+    for b, byte in enumerate((0x5A, 0xA5)):
+        for j in range(8):
+            bits[8 * b + j] = (byte >> j) & 1
+    for i, c in enumerate(TYPE_CODES[dev_type]):
+        bits[16 + i] = int(c)
+
+    negative, digits, point = display_digits(value)
+    for k, (start, ch) in enumerate(zip(DIGIT_FIELDS, digits)):
+        for seg, c in zip(SEGMENT_ORDER, DIGIT_PATTERNS[ch]):
+            bits[start + seg] = int(c)
+        if k and point == k:
+            bits[start] = 1  # decimal point before digit k
+    if negative:
+        bits[DIGIT_FIELDS[0]] = 1
+    for i in MODE_BITS[dev_type][mode]:
+        bits[i] = 1
+    if hold:
+        bits[60 if dev_type != '2' else 25] = 1
+    return encode_bits(bits)
+
+
+class SimulatedMeter:
+    """A virtual meter: offset + sine wave + gaussian noise, in display units."""
+
+    def __init__(self, dev_type='1', mode="V DC", offset=5.0, amplitude=1.0,
+                 period_s=20.0, noise=0.01, seed=None):
+        if mode not in MODE_BITS[dev_type]:
+            raise ValueError(f"Mode {mode!r} not available for type {dev_type}")
+        self.dev_type = dev_type
+        self.mode = mode
+        self.offset = offset
+        self.amplitude = amplitude
+        self.period_s = period_s
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.t0 = time.monotonic()
+
+    def value(self, t=None) -> float:
+        t = time.monotonic() - self.t0 if t is None else t
+        v = self.offset + self.amplitude * math.sin(2 * math.pi * t / self.period_s)
+        return v + self.rng.gauss(0.0, self.noise)
+
+    def frame(self, t=None) -> bytes:
+        return encode_frame(self.dev_type, self.value(t), self.mode)
+
+
+def sim_address(index: int) -> str:
+    return f"SIM:{index:04d}"
+
+
+class SimulatedClient:
+    """Minimal BleakClient stand-in serving frames from a SimulatedMeter."""
+
+    def __init__(self, address, meter=None, latency_s=0.0):
+        index = int(address.rsplit(":", 1)[-1]) if address.startswith("SIM:") else 0
+        types = sorted(TYPE_CODES)
+        self.address = address
+        self.meter = meter or SimulatedMeter(
+            dev_type=types[index % len(types)], offset=1.0 + index, seed=index)
+        self.latency_s = latency_s
+        self.is_connected = False
+
+    async def __aenter__(self):
+        self.is_connected = True
+        return self
+
+    async def __aexit__(self, *exc):
+        self.is_connected = False
+
+    async def read_gatt_char(self, _char, use_cached=False):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return bytearray(self.meter.frame())
+
+
+# ======= Standalone benchmark =======
+
+async def _run_device(meter, hz, stop_at, counts, i):
+    period = 1.0 / hz
+    next_due = time.monotonic()
+    while next_due < stop_at:
+        meter.frame()
+        counts[i] += 1
+        next_due += period
+        await asyncio.sleep(max(0.0, next_due - time.monotonic()))
+
+
+async def _bench(devices, hz, seconds):
+    types = sorted(TYPE_CODES)
+    meters = [SimulatedMeter(dev_type=types[i % len(types)], seed=i) for i in range(devices)]
+    counts = [0] * devices
+    t0 = time.monotonic()
+    cpu0 = time.process_time()
+    await asyncio.gather(*(_run_device(m, hz, t0 + seconds, counts, i)
+                           for i, m in enumerate(meters)))
+    wall = time.monotonic() - t0
+    cpu = time.process_time() - cpu0
+    total = sum(counts)
+    print(f"{devices} devices @ {hz} Hz: {total} frames in {wall:.2f}s "
+          f"({total / wall:.0f} frames/s, {cpu / max(total, 1) * 1e6:.1f} µs CPU/frame)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--devices", type=int, default=10)
+    ap.add_argument("--hz", type=float, default=3.0)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    args = ap.parse_args()
+    try:
+        asyncio.run(_bench(args.devices, args.hz, args.seconds))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
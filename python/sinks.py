@@ -0,0 +1,244 @@
+"""Output sinks for the BLE DMM bridge
+
+Publishes decoded samples to an MQTT broker or a raw TCP line protocol
+(one JSON object per line) over a single persistent connection.
+
+- Samples are queued with offer() and never block the BLE reader
+- The outbound queue is bounded; when full either the oldest or the
+  newest sample is dropped (drop="oldest" | "newest")
+- Queued samples are written in batches of up to batch_size, waiting at
+  most linger seconds for a batch to fill
+- Lost connections are re-established with exponential backoff
+
+Sinks are configured by URL:
+  mqtt://[user:pass@]host[:port]/topic[?client_id=id]
+                                         (MQTT 3.1.1, QoS 0, no deps)
+  tcp://host:port                        (newline delimited JSON)
+
+Requires: nothing beyond the standard library
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from urllib.parse import parse_qs, urlsplit, unquote
+
+LOG = logging.getLogger("ble_dmm_sinks")
+
+RECONNECT_MIN_S = 1.0
+RECONNECT_MAX_S = 30.0
+
+
+class Sink:
+    default_port = 0
+    idle_timeout = None  # seconds without data before keepalive() is called
+
+    def __init__(self, host, port=None, batch_size=64, linger=0.05,
+                 queue_size=1024, drop="oldest"):
+        if drop not in ("oldest", "newest"):
+            raise ValueError(f"drop must be 'oldest' or 'newest', not {drop!r}")
+        self.host = host
+        self.port = port or self.default_port
+        self.batch_size = max(1, int(batch_size))
+        self.linger = max(0.0, float(linger))
+        self.drop = drop
+        self.queue = deque(maxlen=queue_size if drop == "oldest" else None)
+        self.queue_size = queue_size
+        self.sent = 0
+        self.dropped = 0
+        self.connected = False
+        self._wakeup = asyncio.Event()
+        self._drain_task = None  # discards what the server sends, per connection
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.host}:{self.port})"
+
+    # ----- producer side -----
+
+    def offer(self, payload: dict):
+        q = self.queue
+        if len(q) >= self.queue_size:
+            self.dropped += 1
+            if self.drop == "newest":
+                return
+            # deque(maxlen) discards the oldest entry on append
+        q.append(payload)
+        self._wakeup.set()
+
+    def stats(self):
+        return {
+            "sink": repr(self),
+            "connected": self.connected,
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
+
+    # ----- protocol hooks -----
+
+    async def handshake(self, reader, writer):
+        pass
+
+    def encode(self, batch) -> bytes:
+        raise NotImplementedError
+
+    async def keepalive(self, writer):
+        pass
+
+    # ----- connection loop -----
+
+    async def _next_batch(self):
+        while not self.queue:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        if len(self.queue) < self.batch_size and self.linger:
+            await asyncio.sleep(self.linger)
+        q = self.queue
+        return [q.popleft() for _ in range(min(self.batch_size, len(q)))]
+
+    def _requeue(self, batch):
+        # Put an unsent batch back in front; the bounded queue still applies
+        for item in reversed(batch):
+            if len(self.queue) >= self.queue_size:
+                self.dropped += 1
+                continue
+            self.queue.appendleft(item)
+
+    async def run(self, stop_event: asyncio.Event):
+        delay = RECONNECT_MIN_S
+        while not stop_event.is_set():
+            writer = None
+            batch = None
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                await self.handshake(reader, writer)
+                self.connected = True
+                delay = RECONNECT_MIN_S
+                LOG.info("Sink %r connected", self)
+                while not stop_event.is_set():
+                    try:
+                        batch = await asyncio.wait_for(self._next_batch(), self.idle_timeout)
+                    except asyncio.TimeoutError:
+                        await self.keepalive(writer)
+                        continue
+                    writer.write(self.encode(batch))
+                    await writer.drain()
+                    self.sent += len(batch)
+                    batch = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOG.warning("Sink %r error: %s (retrying in %.0fs)", self, e, delay)
+            finally:
+                self.connected = False
+                if self._drain_task is not None:
+                    self._drain_task.cancel()
+                    self._drain_task = None
+                if batch:
+                    self._requeue(batch)
+                if writer is not None:
+                    writer.close()
+            if not stop_event.is_set():
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_S)
+
+
+class TcpLineSink(Sink):
+    default_port = 9000
+
+    def encode(self, batch) -> bytes:
+        return "".join(json.dumps(p, separators=(",", ":")) + "\n" for p in batch).encode("utf-8")
+
+
+# ======= Minimal MQTT 3.1.1 (QoS 0 publish only) =======
+
+def _mqtt_len(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def _mqtt_str(s: str) -> bytes:
+    b = s.encode("utf-8")
+    return len(b).to_bytes(2, "big") + b
+
+
+class MqttSink(Sink):
+    default_port = 1883
+
+    def __init__(self, host, port=None, topic="dmm/reading", client_id=None,
+                 username=None, password=None, keepalive_s=60, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.topic = topic
+        # Brokers drop an existing connection when another one reuses its
+        # client id, so every sink needs its own (at most 23 characters)
+        self.client_id = client_id or f"ble-dmm-{os.urandom(6).hex()}"
+        self.username = username
+        self.password = password
+        self.keepalive_s = keepalive_s
+        # Wake up at half the keep-alive interval to send PINGREQ when idle
+        self.idle_timeout = keepalive_s / 2 if keepalive_s else None
+        self._topic_bytes = _mqtt_str(topic)
+
+    def __repr__(self):
+        return f"MqttSink({self.host}:{self.port}/{self.topic})"
+
+    async def handshake(self, reader, writer):
+        flags = 0x02  # clean session
+        payload = _mqtt_str(self.client_id)
+        if self.username is not None:
+            flags |= 0x80
+            payload += _mqtt_str(self.username)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _mqtt_str(self.password)
+        var = _mqtt_str("MQTT") + bytes([4, flags]) + int(self.keepalive_s).to_bytes(2, "big")
+        body = var + payload
+        writer.write(b"\x10" + _mqtt_len(len(body)) + body)
+        await writer.drain()
+        ack = await asyncio.wait_for(reader.readexactly(4), 10.0)
+        if ack[0] != 0x20 or ack[3] != 0:
+            raise ConnectionError(f"MQTT CONNACK refused (code {ack[3]})")
+        # Nothing else is ever read; discard PINGRESP etc. in the background
+        self._drain_task = asyncio.get_running_loop().create_task(self._drain_reader(reader))
+
+    @staticmethod
+    async def _drain_reader(reader):
+        try:
+            while await reader.read(1024):
+                pass
+        except Exception:
+            pass
+
+    def encode(self, batch) -> bytes:
+        out = bytearray()
+        topic = self._topic_bytes
+        for p in batch:
+            body = topic + json.dumps(p, separators=(",", ":")).encode("utf-8")
+            out += b"\x30" + _mqtt_len(len(body)) + body
+        return bytes(out)
+
+    async def keepalive(self, writer):
+        writer.write(b"\xc0\x00")
+        await writer.drain()
+
+
+def make_sink(url: str, **kwargs):
+    """Build a sink from a mqtt:// or tcp:// URL; kwargs go to Sink()."""
+    u = urlsplit(url)
+    if u.scheme == "tcp":
+        return TcpLineSink(u.hostname, u.port, **kwargs)
+    if u.scheme == "mqtt":
+        topic = unquote(u.path.lstrip("/")) or "dmm/reading"
+        client_id = parse_qs(u.query).get("client_id", [None])[-1]
+        return MqttSink(
+            u.hostname, u.port, topic=topic, client_id=client_id,
+            username=unquote(u.username) if u.username else None,
+            password=unquote(u.password) if u.password else None,
+            **kwargs,
+        )
+    raise ValueError(f"Unsupported sink URL: {url}")
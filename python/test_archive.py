@@ -0,0 +1,133 @@
+"""Round-trip tests for the on-disk archive format (archive.py)
+
+Run from this directory: python -m unittest test_archive
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import archive
+from history import Recorder
+
+T0 = 497_222 * 3600 * 1_000_000_000  # start of an hour, epoch ns
+
+
+def make_records(device, n, start_ns=T0, step_ns=333_000_000):
+    records = []
+    for i in range(n):
+        records.append({
+            "device": device,
+            "t_wall_ns": start_ns + i * step_ns + (i % 3) * 1_000_000,  # some jitter
+            "t_mono_ns": i,
+            "value": ["1.234", "1.234", "-0.056", "OL", None, "12.30"][i % 6],
+            "unit": "DC V" if i < n // 2 else "AC m V",
+            "functions": "Auto" if i % 5 else "Auto HOLD",
+            "derived": {"ema": None if i == 0 else i * 0.5, "d": -1.25e-3 * i},
+        })
+    return records
+
+
+def archived(r):
+    # What survives archiving: ms timestamps, no monotonic time
+    return {**r, "t_wall_ns": r["t_wall_ns"] // archive.TIME_UNIT_NS * archive.TIME_UNIT_NS,
+            "t_mono_ns": None}
+
+
+class BlockRoundTrip(unittest.TestCase):
+    def test_encode_decode(self):
+        records = make_records("AA:BB", 500)
+        self.assertEqual(archive.decode_block(archive.encode_block("AA:BB", records)),
+                         [archived(r) for r in records])
+
+    def test_irregular_times(self):
+        gaps = [0, 1, 1_000, 65_000, 3_600_000, 2**33, 7]
+        t, records = T0, []
+        for i, gap in enumerate(gaps):
+            t += gap * archive.TIME_UNIT_NS
+            records.append({"device": "x", "t_wall_ns": t, "value": str(i), "unit": "V",
+                            "functions": "", "derived": {}})
+        decoded = archive.decode_block(archive.encode_block("x", records))
+        self.assertEqual([r["t_wall_ns"] for r in decoded], [r["t_wall_ns"] for r in records])
+
+
+class SegmentRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def record(self, records, segment_s=3600):
+        rec = Recorder(self.dir, segment_s)
+        for r in records:
+            rec.write(r)
+        rec.close()
+
+    def test_compact_and_query(self):
+        a, b = make_records("A", 3000), make_records("B", 10)
+        self.record(sorted(a + b, key=lambda r: r["t_wall_ns"]))
+        (path,) = [os.path.join(self.dir, f) for f in os.listdir(self.dir)]
+        out = archive.compact_segment(path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(archive.query_archive(out, "A"), [archived(r) for r in a])
+        self.assertEqual(archive.query_archive(out, "B"), [archived(r) for r in b])
+
+        since, until = a[1000]["t_wall_ns"], a[1500]["t_wall_ns"]
+        self.assertEqual(archive.query(self.dir, "A", since, until),
+                         [archived(r) for r in a[1000:1501]])
+
+    def test_late_samples_are_kept(self):
+        # Sources interleave across a segment boundary
+        before = make_records("A", 101, start_ns=T0 + 3599 * 1_000_000_000, step_ns=1_000_000)
+        after = make_records("A", 1, start_ns=T0 + 3600 * 1_000_000_000)
+        late = make_records("B", 2, start_ns=T0 + 3599 * 1_000_000_000 + 500_000_000)
+        rec = Recorder(self.dir, 3600)
+        rec.on_close.append(archive.compact_segment)  # as the bridge does
+        for r in before + after + late:
+            rec.write(r)
+        rec.close()
+        for f in os.listdir(self.dir):
+            if f.endswith(".jsonl"):
+                archive.compact_segment(os.path.join(self.dir, f))
+        self.assertEqual(len(archive.query(self.dir, "A")), 102)
+        self.assertEqual(len(archive.query(self.dir, "B")), 2)
+
+    def test_merge_into_existing_archive(self):
+        first, second = make_records("A", 20), make_records("A", 20, start_ns=T0 + 60 * 10**9)
+        self.record(first)
+        (path,) = [os.path.join(self.dir, f) for f in os.listdir(self.dir)]
+        archive.compact_segment(path)
+        self.record(second)
+        archive.compact_segment(path, keep_source=True)
+        archive.compact_segment(path)  # the same source again adds nothing
+        self.assertEqual(archive.query(self.dir, "A"), [archived(r) for r in first + second])
+
+    def test_limit_reads_newest_files_only(self):
+        hours = [make_records("A", 100, start_ns=T0 + h * 3600 * 10**9, step_ns=10**9)
+                 for h in range(4)]
+        rec = Recorder(self.dir, 3600)
+        rec.on_close.append(archive.compact_segment)
+        for r in sum(hours, []):
+            rec.write(r)
+        rec.close()
+        everything = archive.query(self.dir, "A")
+        self.assertEqual(len(everything), 400)
+
+        opened = []
+        real = archive._query_file
+        with mock.patch.object(archive, "_query_file",
+                               lambda path, *a: opened.append(path) or real(path, *a)):
+            newest = archive.query(self.dir, "A", limit=150)
+        self.assertEqual(newest, everything[-150:])
+        self.assertEqual(len(opened), 2)
+
+        self.assertEqual(archive.query(self.dir, "A", until_ns=hours[1][-1]["t_wall_ns"], limit=5),
+                         [archived(r) for r in hours[1][-5:]])
+        self.assertEqual(archive.query(self.dir, "A", since_ns=hours[2][0]["t_wall_ns"], limit=1000),
+                         everything[200:])
+
+
+if __name__ == "__main__":
+    unittest.main()
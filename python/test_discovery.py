@@ -0,0 +1,70 @@
+"""Tests for meter discovery (discovery.py) with a stand-in scanner
+
+Run from this directory: python -m unittest test_discovery
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import discovery
+from discovery import SERVICE_UUIDS, DeviceCache, Discovery
+
+
+class FakeScanner:
+    """Replays `adverts` as (address, name, uuids) once started."""
+    adverts = []
+
+    def __init__(self, detection_callback):
+        self.callback = detection_callback
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._replay())
+
+    async def _replay(self):
+        while True:
+            await asyncio.sleep(0.01)
+            for address, name, uuids in self.adverts:
+                self.callback(SimpleNamespace(address=address, name=None),
+                              SimpleNamespace(local_name=name, service_uuids=uuids))
+
+    async def stop(self):
+        self.task.cancel()
+
+
+class Resolve(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(discovery, "BleakScanner", FakeScanner)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache = DeviceCache(path=os.path.join(self.tmp.name, "devices.json"))
+        self.discovery = Discovery(names=("BDM",), cache=cache)
+
+    def advertise(self, *adverts):
+        FakeScanner.adverts = list(adverts)
+
+    async def test_name_wins_over_uuid_match(self):
+        self.advertise(("AA:01", None, [SERVICE_UUIDS[0]]), ("AA:02", "BDM", []))
+        self.assertEqual(await self.discovery.resolve("BDM", timeout=1.0), "AA:02")
+
+    async def test_uuid_match_without_the_name(self):
+        self.advertise(("AA:03", "Other", []), ("AA:01", None, [SERVICE_UUIDS[1].upper()]))
+        self.assertEqual(await self.discovery.resolve("BDM", timeout=0.2), "AA:01")
+
+    async def test_nothing_matches(self):
+        self.advertise(("AA:03", "Other", ["0000180f-0000-1000-8000-00805f9b34fb"]))
+        self.assertIsNone(await self.discovery.resolve("BDM", timeout=0.1))
+
+    async def test_cached_name(self):
+        self.discovery.cache.remember("AA:04", name="BDM")
+        self.advertise()
+        self.assertEqual(await self.discovery.resolve("BDM", timeout=0.1), "AA:04")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests for the streaming distributions (distribution.py)
+
+Run from this directory: python -m unittest test_distribution
+"""
+import os
+import tempfile
+import unittest
+
+from distribution import DistributionStore, quantity
+
+T0 = 1_790_000_000 * 1_000_000_000  # epoch ns
+
+# The same modes as decoded from each meter type; decoder_1 (types 1, 3, 4)
+# and decoder_2 list the annunciators in a different order
+TYPE_1 = {"V AC": "V AC", "mV DC": "DC m V", "A DC": "A DC", "Ω": "Ω"}
+TYPE_2 = {"V AC": "AC V", "mV DC": "m DC V", "A DC": "A DC", "Ω": "Ω"}
+
+
+class Quantity(unittest.TestCase):
+    def test_decoder_order_does_not_matter(self):
+        for mode in TYPE_1:
+            self.assertEqual(quantity(TYPE_1[mode]), quantity(TYPE_2[mode]))
+        self.assertEqual(quantity("V AC"), "AC V")
+        self.assertEqual(quantity("DC m V"), "DC V")
+        self.assertEqual(quantity("M Ω"), "Ω")
+        self.assertEqual(quantity(""), "")
+
+
+class MergeMeters(unittest.TestCase):
+    def fill(self, store):
+        for i in range(100):
+            t = T0 + i * 1_000_000_000
+            store.add("type1", t, f"{230 + i % 3}.0", TYPE_1["V AC"])
+            store.add("type2", t, f"{231 + i % 3}.0", TYPE_2["V AC"])
+            store.add("type1", t, "12.5", TYPE_1["mV DC"])
+            store.add("type2", t, "0.0125", "DC V")
+
+    def test_type_1_and_type_2_merge(self):
+        store = DistributionStore()
+        self.fill(store)
+        merged = store.query()
+        self.assertEqual(sorted(merged), ["AC V", "DC V"])
+        self.assertEqual(merged["AC V"].count, 200)
+        self.assertEqual((merged["AC V"].min, merged["AC V"].max), (230.0, 233.0))
+        self.assertAlmostEqual(merged["DC V"].max, 0.0125)
+
+        # ?unit= goes through quantity() as well
+        for unit in ("V AC", "AC V", "AC m V"):
+            self.assertEqual(store.query(quantities={quantity(unit)})["AC V"].count, 200)
+        by_bucket = store.query(quantities={quantity("V AC")}, since_s=T0 // 10**9)
+        self.assertEqual(by_bucket["AC V"].count, 200)
+
+    def test_old_keys_merge_on_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dist.json")
+            store = DistributionStore(path=path)
+            self.fill(store)
+            data = store.snapshot()
+            # As saved before quantities were canonical
+            for key in data["buckets"] + data["totals"]:
+                if key[1] == "type1" and key[2] == "AC V":
+                    key[2] = "V AC"
+            store.write(data)
+            loaded = DistributionStore(path=path).query()
+            self.assertEqual(sorted(loaded), ["AC V", "DC V"])
+            self.assertEqual(loaded["AC V"].count, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
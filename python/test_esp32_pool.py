@@ -0,0 +1,156 @@
+"""Tests for the ESP32 poller (esp32_pool.py) against stand-in HTTP servers
+
+Run from this directory: python -m unittest test_esp32_pool
+"""
+import asyncio
+import json
+import socket
+import unittest
+
+from aiohttp import web
+
+from esp32_pool import Esp32Poller, endpoint_address
+
+MIN, MAX = 0.01, 0.08
+
+
+def reading(value, unit="DC V"):
+    return {"value": value, "unit": unit, "functions": "Auto"}
+
+
+class StandIn:
+    """aiohttp server whose n-th GET /api/latest answers respond(n)."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = 0
+        self.intervals = []  # poller interval seen at each request
+        self.poller = None
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/api/latest", self._latest)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = "http://127.0.0.1:%d" % self.runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+    async def _latest(self, _req):
+        self.requests += 1
+        if self.poller is not None and self.requests > 1:
+            self.intervals.append(self.poller.stats[endpoint_address(self.url)]["interval"])
+        r = self.respond(self.requests)
+        if isinstance(r, web.Response):
+            return r
+        return web.Response(text=json.dumps(r), content_type="application/json")
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class PollerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.samples = []
+        self.statuses = []
+
+    async def on_sample(self, address, **fields):
+        self.samples.append(fields["value"])
+
+    def poller(self, endpoints, **kwargs):
+        return Esp32Poller(endpoints, kwargs.pop("on_sample", self.on_sample),
+                           on_status=lambda address, ok: self.statuses.append(ok),
+                           min_interval=MIN, max_interval=MAX, backoff=2.0, timeout=1.0, **kwargs)
+
+    async def run_until(self, poller, done, timeout=5.0):
+        stop = asyncio.Event()
+        task = asyncio.create_task(poller.run(stop))
+        try:
+            for _ in range(int(timeout / 0.005)):
+                if done():
+                    break
+                await asyncio.sleep(0.005)
+            else:
+                self.fail("condition not reached")
+        finally:
+            stop.set()
+            await asyncio.wait_for(task, 5.0)
+
+    async def test_interval_follows_changes(self):
+        values = ["1", "2", "3", "3", "3", "3", "3", "4", "4"]
+        async with StandIn(lambda n: reading(values[min(n, len(values)) - 1])) as server:
+            server.poller = poller = self.poller([server.url])
+            await self.run_until(poller, lambda: server.requests >= 9)
+        # Steady readings back off by 2x up to MAX; a change drops to MIN at once
+        self.assertEqual([round(i, 3) for i in server.intervals[:8]],
+                         [MIN, MIN, MIN, 0.02, 0.04, MAX, MAX, MIN])
+        self.assertEqual(self.samples[:9], values)
+        self.assertEqual(self.statuses, [True])
+
+    async def test_unreachable_host_backs_off(self):
+        poller = self.poller([f"127.0.0.1:{closed_port()}"])
+        address = endpoint_address(poller.endpoints[0])
+        await self.run_until(poller, lambda: poller.stats.get(address, {}).get("errors", 0) >= 5)
+        st = poller.stats[address]
+        self.assertEqual(st["interval"], MAX)
+        self.assertEqual((st["polls"], st["connected"]), (0, False))
+        self.assertEqual(self.statuses, [False])
+        self.assertEqual(self.samples, [])
+
+    async def test_status_transitions(self):
+        def respond(n):
+            if n in (3, 4):
+                return web.Response(status=503)
+            return reading(str(n))
+        async with StandIn(respond) as server:
+            server.poller = poller = self.poller([server.url])
+            await self.run_until(poller, lambda: server.requests >= 6)
+        self.assertEqual(self.statuses, [True, False, True])
+        self.assertEqual(self.samples[:3], ["1", "2", "5"])
+        # Errors back off from the current interval, success resets it
+        self.assertEqual([round(i, 3) for i in server.intervals[:4]], [MIN, MIN, 0.02, 0.04])
+        self.assertEqual(server.intervals[4], MIN)
+
+    async def test_non_object_body(self):
+        def respond(n):
+            return [1, 2] if n == 1 else "null" if n == 2 else reading("1")
+        async with StandIn(respond) as server:
+            poller = self.poller([server.url])
+            await self.run_until(poller, lambda: self.samples)
+        st = poller.stats[endpoint_address(server.url)]
+        self.assertEqual(st["errors"], 2)
+        self.assertEqual(self.statuses, [False, True])
+
+    async def test_on_sample_raising_keeps_polling(self):
+        calls = []
+
+        async def on_sample(address, **fields):
+            calls.append(fields["value"])
+            if len(calls) <= 2:
+                raise RuntimeError("derived channel blew up")
+
+        async with StandIn(lambda n: reading(str(n))) as server:
+            poller = self.poller([server.url], on_sample=on_sample)
+            with self.assertLogs("ble_dmm_esp32", "ERROR") as logs:
+                await self.run_until(poller, lambda: len(calls) >= 4)
+        self.assertEqual(len(logs.records), 1)  # once per run of failures
+        st = poller.stats[endpoint_address(server.url)]
+        self.assertEqual(st["errors"], 2)
+        self.assertEqual(self.statuses, [True])
+
+    async def test_one_dead_host_does_not_stall_the_others(self):
+        async with StandIn(lambda n: reading(str(n))) as server:
+            poller = self.poller([f"127.0.0.1:{closed_port()}", server.url])
+            await self.run_until(poller, lambda: len(self.samples) >= 5)
+        self.assertEqual(sorted(self.statuses), [False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Tests for the shared-memory sample ring and the shard supervisor (shards.py)
+
+Run from this directory: python -m unittest test_shards
+"""
+import asyncio
+import os
+import unittest
+
+from shards import ADDRESS_BYTES, CONNECTED, SAMPLE, SampleRing, Supervisor
+
+
+def crash(code):
+    os._exit(code)
+
+
+class Ring(unittest.TestCase):
+    def setUp(self):
+        self.ring = SampleRing.create(slots=8)
+        self.addCleanup(self.ring.close)
+
+    def test_round_trip(self):
+        reader = SampleRing.attach(self.ring.name)
+        self.addCleanup(reader.close)
+        address = "A" * ADDRESS_BYTES
+        self.ring.write_sample(address, 1, 2, "1.234", "DC V", "Auto")
+        self.ring.write_status(address, connected=False)
+        self.assertEqual(list(reader.read()), [
+            (SAMPLE, address, {"t_mono_ns": 1, "t_wall_ns": 2, "value": "1.234",
+                               "unit": "DC V", "functions": "Auto", "connected": True}),
+            (CONNECTED, address, {"connected": False}),
+        ])
+
+    def test_lapped_reader_counts_losses(self):
+        reader = SampleRing.attach(self.ring.name)
+        self.addCleanup(reader.close)
+        for i in range(20):
+            self.ring.write_sample("x", i, i, str(i), "V", "")
+        values = [f["value"] for _, _, f in reader.read()]
+        self.assertEqual(values, [str(i) for i in range(12, 20)])
+        self.assertEqual(reader.lost, 12)
+
+
+class SupervisorExit(unittest.IsolatedAsyncioTestCase):
+    async def test_on_exit_hears_of_crashes(self):
+        exits = []
+        stop = asyncio.Event()
+
+        def on_exit(name, code):
+            exits.append((name, code))
+            stop.set()
+
+        supervisor = Supervisor(crash, min_delay=60.0, on_exit=on_exit)
+        supervisor.add("shard-0", 3)
+        await asyncio.wait_for(supervisor.run(stop, check_s=0.05), 30.0)
+        self.assertEqual(exits, [("shard-0", 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
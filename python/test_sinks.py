@@ -0,0 +1,245 @@
+"""Tests for the output sinks (sinks.py) against local stand-in servers
+
+Run from this directory: python -m unittest test_sinks
+"""
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import sinks
+
+
+async def read_mqtt_packet(reader):
+    first = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return first, await reader.readexactly(length)
+
+
+def mqtt_str(body, pos):
+    n = int.from_bytes(body[pos:pos + 2], "big")
+    return body[pos + 2:pos + 2 + n].decode("utf-8"), pos + 2 + n
+
+
+class StandIn:
+    """asyncio.start_server wrapper that records what the sink sends."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.connections = 0
+        self.received = []
+        self.client_ids = []
+        self.topics = []
+        self.got = asyncio.Event()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            await self.handler(self, reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def add(self, payload):
+        self.received.append(payload)
+        self.got.set()
+
+    async def wait_for(self, n, timeout=5.0):
+        async def enough():
+            while len(self.received) < n:
+                self.got.clear()
+                await self.got.wait()
+        await asyncio.wait_for(enough(), timeout)
+
+
+async def tcp_lines(server, reader, writer):
+    while line := await reader.readline():
+        server.add(json.loads(line))
+
+
+def mqtt_broker(return_code=0, hang_up_after=None):
+    async def serve(server, reader, writer):
+        kind, body = await read_mqtt_packet(reader)
+        assert kind == 0x10, kind
+        name, pos = mqtt_str(body, 0)
+        assert (name, body[pos]) == ("MQTT", 4)
+        server.client_ids.append(mqtt_str(body, pos + 4)[0])
+        writer.write(bytes([0x20, 2, 0, return_code]))
+        await writer.drain()
+        while True:
+            kind, body = await read_mqtt_packet(reader)
+            if kind == 0xC0:
+                writer.write(b"\xd0\x00")  # PINGRESP
+            elif kind == 0x30:
+                topic, pos = mqtt_str(body, 0)
+                server.topics.append(topic)
+                server.add(json.loads(body[pos:]))
+                if server.connections == 1 and len(server.received) == hang_up_after:
+                    return
+    return serve
+
+
+class SinkTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(sinks, "RECONNECT_MIN_S", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stop = asyncio.Event()
+        self.tasks = []
+
+    async def asyncTearDown(self):
+        self.stop.set()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def start(self, sink):
+        self.tasks.append(asyncio.create_task(sink.run(self.stop)))
+        return sink
+
+
+class Queue(unittest.TestCase):
+    def offer(self, drop):
+        sink = sinks.TcpLineSink("127.0.0.1", 9, queue_size=3, drop=drop)
+        for i in range(5):
+            sink.offer({"i": i})
+        return sink
+
+    def test_drop_oldest(self):
+        sink = self.offer("oldest")
+        self.assertEqual([p["i"] for p in sink.queue], [2, 3, 4])
+        self.assertEqual(sink.dropped, 2)
+
+    def test_drop_newest(self):
+        sink = self.offer("newest")
+        self.assertEqual([p["i"] for p in sink.queue], [0, 1, 2])
+        self.assertEqual(sink.dropped, 2)
+
+    def test_requeue_keeps_the_bound(self):
+        sink = self.offer("newest")
+        sink.queue.popleft()
+        sink._requeue([{"i": "a"}, {"i": "b"}])
+        self.assertEqual([p["i"] for p in sink.queue], ["b", 1, 2])
+        self.assertEqual(sink.dropped, 3)
+
+    def test_bad_drop_policy(self):
+        with self.assertRaises(ValueError):
+            sinks.TcpLineSink("127.0.0.1", drop="random")
+
+
+class TcpSink(SinkTest):
+    async def test_batches_in_order(self):
+        batches = []
+
+        class Recording(sinks.TcpLineSink):
+            def encode(self, batch):
+                batches.append(len(batch))
+                return super().encode(batch)
+
+        async with StandIn(tcp_lines) as server:
+            sink = Recording("127.0.0.1", server.port, batch_size=4, linger=0.05)
+            for i in range(10):
+                sink.offer({"i": i})
+            self.start(sink)
+            await server.wait_for(10)
+        self.assertEqual([p["i"] for p in server.received], list(range(10)))
+        self.assertEqual(batches, [4, 4, 2])
+        self.assertEqual(sink.sent, 10)
+
+    async def test_requeue_after_dropped_connection(self):
+        class Flaky(sinks.TcpLineSink):
+            failed = False
+
+            def encode(self, batch):
+                if not self.failed:
+                    self.failed = True
+                    raise ConnectionResetError("connection dropped")
+                return super().encode(batch)
+
+        async with StandIn(tcp_lines) as server:
+            sink = Flaky("127.0.0.1", server.port, batch_size=3, linger=0)
+            for i in range(5):
+                sink.offer({"i": i})
+            self.start(sink)
+            await server.wait_for(5)
+        self.assertEqual([p["i"] for p in server.received], list(range(5)))
+        self.assertEqual(server.connections, 2)
+        self.assertEqual((sink.sent, sink.dropped), (5, 0))
+
+
+class MqttSink(SinkTest):
+    async def test_publish_with_client_id_from_url(self):
+        async with StandIn(mqtt_broker()) as server:
+            sink = sinks.make_sink(f"mqtt://127.0.0.1:{server.port}/plant/dmm?client_id=bench-3",
+                                   linger=0)
+            sink.offer({"value": "1.234", "unit": "DC V"})
+            self.start(sink)
+            await server.wait_for(1)
+        self.assertEqual(server.client_ids, ["bench-3"])
+        self.assertEqual(server.topics, ["plant/dmm"])
+        self.assertEqual(server.received, [{"value": "1.234", "unit": "DC V"}])
+
+    async def test_default_client_ids_differ(self):
+        async with StandIn(mqtt_broker()) as server:
+            url = f"mqtt://127.0.0.1:{server.port}/dmm"
+            for _ in range(2):
+                self.start(sinks.make_sink(url, linger=0)).offer({"value": "1"})
+            await server.wait_for(2)
+        self.assertEqual(len(set(server.client_ids)), 2)
+        self.assertTrue(all(len(c) <= 23 for c in server.client_ids))
+
+    async def test_connack_refused(self):
+        async with StandIn(mqtt_broker(return_code=5)) as server:
+            sink = self.start(sinks.make_sink(f"mqtt://127.0.0.1:{server.port}/dmm", linger=0))
+            sink.offer({"value": "1"})
+            for _ in range(500):
+                if server.connections >= 3:
+                    break
+                await asyncio.sleep(0.01)
+        self.assertFalse(sink.connected)
+        self.assertEqual(server.received, [])
+        self.assertEqual((sink.sent, len(sink.queue)), (0, 1))
+
+    async def test_drain_task_ends_with_its_connection(self):
+        def drain_tasks():
+            return [t for t in asyncio.all_tasks()
+                    if t.get_coro().__qualname__ == "MqttSink._drain_reader" and not t.done()]
+
+        async with StandIn(mqtt_broker(hang_up_after=1)) as server:
+            sink = self.start(sinks.make_sink(f"mqtt://127.0.0.1:{server.port}/dmm", linger=0))
+            sink.offer({"value": 1})
+            await server.wait_for(1)
+            # Samples written before the hang-up is noticed are lost; keep
+            # offering until the second connection delivers one
+            for i in range(2, 500):
+                sink.offer({"value": i})
+                await asyncio.sleep(0.01)
+                if server.connections == 2 and len(server.received) > 1:
+                    break
+            self.assertEqual(server.connections, 2)
+            self.assertEqual(drain_tasks(), [sink._drain_task])
+            current = sink._drain_task
+            await self.asyncTearDown()
+            self.tasks = []
+        self.assertTrue(current.cancelled())
+        self.assertIsNone(sink._drain_task)
+
+
+if __name__ == "__main__":
+    unittest.main()